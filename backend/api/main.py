@@ -23,7 +23,8 @@ from backend.api.routes_assets import router as assets_router
 from backend.api.routes_pairs import router as pairs_router
 from backend.api.routes_columns import router as columns_router
 from backend.api.routes_settings import router as settings_router
-from db.database import ensure_tables_exist
+from backend.trading.order_service import seed_trans_id_counter
+from db.database import AsyncSessionLocal, ensure_tables_exist
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +54,17 @@ app.include_router(settings_router)
 @app.on_event("startup")
 async def _on_startup() -> None:  # noqa: D401
     await ensure_tables_exist()
+    # Засеваем дневной счётчик TRANS_ID из БД; дальше номера выдаются в памяти
+    try:
+        async with AsyncSessionLocal() as session:
+            await seed_trans_id_counter(session)
+    except Exception as exc:  # pragma: no cover
+        logger.error("[startup] TRANS_ID counter seed failed: %s", exc)
+    # Создаём OrderManager внутри event-loop и подгружаем активные ордера прошлой сессии
+    try:
+        await container.order_manager().warmup()
+    except Exception as exc:  # pragma: no cover
+        logger.error("[startup] OrderManager warmup failed: %s", exc)
     logger.info("[startup] DB tables ensured. App ready.")
 
 
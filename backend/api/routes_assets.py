@@ -15,6 +15,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
+from core.order_manager import invalidate_ticker_aliases
 from db.database import get_session
 from db.models import Asset as AssetModel
 from backend.api.schemas import (
@@ -55,6 +56,7 @@ async def create_asset(payload: AssetCreate, session: AsyncSession = Depends(get
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Asset already exists")
+    invalidate_ticker_aliases()
     await session.refresh(asset)
     return asset
 
@@ -70,6 +72,7 @@ async def update_asset_full(asset_id: int, payload: AssetCreate, session: AsyncS
     for field, value in payload.model_dump().items():
         setattr(asset, field, value)
     await session.commit()
+    invalidate_ticker_aliases()
     await session.refresh(asset)
     return asset
 
@@ -82,6 +85,7 @@ async def update_asset_partial(asset_id: int, payload: AssetUpdate, session: Asy
         setattr(asset, field, value)
     try:
         await session.commit()
+        invalidate_ticker_aliases()
         await session.refresh(asset)
         return asset
     except Exception as e:
@@ -96,4 +100,5 @@ async def delete_asset(asset_id: int, session: AsyncSession = Depends(get_sessio
     asset = await _get_asset_or_404(session, asset_id)
     await session.delete(asset)
     await session.commit()
+    invalidate_ticker_aliases()
     return None
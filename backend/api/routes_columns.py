@@ -11,7 +11,7 @@ DELETE /api/columns/{id}     – удалить
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.database import get_session
@@ -96,9 +96,7 @@ async def delete_column(col_id: int, session: AsyncSession = Depends(get_session
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_all_columns(session: AsyncSession = Depends(get_session)):
     """Delete all column settings (reset to default)."""
-    res = await session.execute(select(ColumnModel))
-    columns = res.scalars().all()
-    for col in columns:
-        await session.delete(col)
+    # Один DELETE вместо SELECT всех строк и удаления по одной
+    await session.execute(delete(ColumnModel).execution_options(synchronize_session=False))
     await session.commit()
     return None
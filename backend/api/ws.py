@@ -120,13 +120,15 @@ async def ws_quotes(ws: WebSocket) -> None:  # noqa: D401
                     await send_json_safe({"type": "error", "message": "Empty class_code or sec_code"})
                     continue
                 
+                # Подписка – блокирующий запрос к QuikPy: выполняем в пуле потоков,
+                # чтобы не останавливать event-loop для остальных клиентов
                 if current_sub:
-                    actions.stop_quotes(*current_sub, quote_callback, broker=broker)
-                actions.start_quotes(class_code, sec_code, quote_callback, broker=broker)
+                    await asyncio.to_thread(actions.stop_quotes, *current_sub, quote_callback, broker=broker)
+                await asyncio.to_thread(actions.start_quotes, class_code, sec_code, quote_callback, broker=broker)
                 current_sub = (class_code, sec_code)
             elif action == "stop":
                 if current_sub:
-                    actions.stop_quotes(*current_sub, quote_callback, broker=broker)
+                    await asyncio.to_thread(actions.stop_quotes, *current_sub, quote_callback, broker=broker)
                     current_sub = None
             elif action == "send_pair_order":
                 ok, msg_text = await actions.send_pair_order(msg, broker=broker)
@@ -152,6 +154,6 @@ async def ws_quotes(ws: WebSocket) -> None:  # noqa: D401
     finally:
         ws_manager.disconnect(ws)  # Отключаем соединение
         if current_sub:
-            actions.stop_quotes(*current_sub, quote_callback, broker=broker)
+            await asyncio.to_thread(actions.stop_quotes, *current_sub, quote_callback, broker=broker)
         # Отписываемся от heartbeat
         connector.unregister_heartbeat_callback(heartbeat_callback)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import itertools
+import time
 from datetime import datetime, timezone
 
 from sqlalchemy import select, func
@@ -7,23 +9,93 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import Order  # type: ignore
 
-__all__ = ["get_next_trans_id"]
+__all__ = [
+    "allocate_trans_ids",
+    "get_next_trans_id",
+    "get_next_trans_ids",
+    "next_trans_id",
+    "seed_trans_id_counter",
+]
+
+
+# Счётчик служебных TRANS_ID (KILL_ORDER / MOVE_ORDERS / перевыставление).
+# Стартуем от текущего unix-time: такие номера не пересекаются с дневными
+# TRANS_ID из get_next_trans_id и с номерами предыдущего запуска процесса,
+# а до 2038 года укладываются в положительный 32-битный int, как требует QUIK.
+_service_trans_ids = itertools.count(int(time.time()))
+
+
+def next_trans_id() -> int:
+    """Возвращает следующий служебный TRANS_ID (уникален в пределах процесса)."""
+    return next(_service_trans_ids)
+
+
+# Последний выданный дневной TRANS_ID: (начало дня UTC, номер). Из БД счётчик
+# засевается один раз при старте (seed_trans_id_counter), дальше номера выдаются
+# в памяти без SQL. Отдельно счётчик не сохраняем: выданные номера попадают
+# в orders.trans_id вместе с самими ордерами.
+_last_issued: tuple[datetime, int] | None = None
+
+
+def _today_start() -> datetime:
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def seed_trans_id_counter(session: AsyncSession) -> None:
+    """Засевает счётчик дневных TRANS_ID максимальным trans_id сегодняшних ордеров.
+
+    Вызывается один раз при старте приложения (нет записей — 0).
+    """
+    global _last_issued
+    today_start = _today_start()
+    # «+ 0» отключает min/max-оптимизацию SQLite по ix_orders_trans_id (обратный проход
+    # по всем дням до первой сегодняшней строки) – запрос идёт по покрывающему
+    # ix_orders_created_trans, диапазон только за сегодня
+    stmt = (
+        select(func.max(Order.trans_id + 0))
+        .where(Order.created_at >= today_start)
+    )
+    seed: int = (await session.execute(stmt)).scalar() or 0
+    # Пока ждали БД, параллельный вызов мог уже засеять счётчик и выдать номера
+    if _last_issued is None or _last_issued[0] != today_start:
+        _last_issued = (today_start, seed)
+    else:
+        _last_issued = (today_start, max(_last_issued[1], seed))
+
+
+def allocate_trans_ids(n: int) -> list[int]:
+    """Резервирует `n` последовательных TRANS_ID текущего дня (без обращения к БД).
+
+    Требует засеянного счётчика (seed_trans_id_counter), иначе RuntimeError.
+    При смене дня счётчик начинается с нуля: сегодняшних ордеров, кроме выданных
+    этим процессом, в БД быть не может.
+    """
+    global _last_issued
+    if _last_issued is None:
+        raise RuntimeError("Счётчик TRANS_ID не засеян: нужен seed_trans_id_counter()")
+    today_start = _today_start()
+    last = _last_issued[1] if _last_issued[0] == today_start else 0
+    _last_issued = (today_start, last + n)
+    return list(range(last + 1, last + n + 1))
 
 
 async def get_next_trans_id(session: AsyncSession) -> int:
     """Возвращает следующий TRANS_ID для текущего дня.
 
     Алгоритм:
-    1. Берём максимальный trans_id среди ордеров, созданных **сегодня**.
-    2. Если записей нет — возвращаем 1.
-    3. Иначе — max + 1.
+    1. Если счётчик ещё не засеян, берём максимальный trans_id среди ордеров,
+       созданных **сегодня** (нет записей — 0).
+    2. Дальше увеличиваем счётчик в памяти процесса.
     """
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (await get_next_trans_ids(session, 1))[0]
 
-    stmt = (
-        select(func.max(Order.trans_id))
-        .where(Order.created_at >= today_start)
-    )
-    result = await session.execute(stmt)
-    max_trans_id: int | None = result.scalar()
-    return (max_trans_id or 0) + 1 
\ No newline at end of file
+
+async def get_next_trans_ids(session: AsyncSession, n: int) -> list[int]:
+    """Резервирует `n` последовательных TRANS_ID текущего дня.
+
+    То же, что allocate_trans_ids, но сам засевает счётчик из БД, если это ещё
+    не сделано (скрипты, сбой засева при старте).
+    """
+    if _last_issued is None:
+        await seed_trans_id_counter(session)
+    return allocate_trans_ids(n)
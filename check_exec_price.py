@@ -7,118 +7,236 @@ exec_price = SUM(price_1 * qty_1 / qty_ratio_1) * price_ratio_1
            - SUM(price_2 * qty_2 / qty_ratio_2) * price_ratio_2
 
 Нога определяется через справочник assets_table: sec_code (ticker) -> code (alias)
+
+Запуск с ключом --summary выводит только пары с расхождением; расчёт
+целиком выполняется в БД одним GROUP BY-запросом.
 """
 import asyncio
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+import io
+import sys
+from sqlalchemy import Float, case, cast, func, select
 from db.database import AsyncSessionLocal
-from db.models import Order, Pair, Asset
+from db.models import Order, Pair, Asset, Instrument
+
+def _as_float(column):
+    """CAST Numeric-колонки к Float с сохранением имени (драйвер сразу отдаёт float)."""
+    return cast(column, Float).label(column.key)
+
+
+# Размер пачки при потоковом чтении ордеров
+ORDERS_CHUNK = 1000
+
+# Разделители отчёта
+HR80 = "=" * 80
+HR60 = "─" * 60
 
 async def check_exec_price():
+    # Строки отчёта копим в буфере и выводим одной записью на пару (см. flush):
+    # в памяти держим только текст текущей пары, а не всего отчёта
+    buf = io.StringIO()
+
+    def out(*args) -> None:
+        print(*args, file=buf)
+
+    def flush() -> None:
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+        buf.seek(0)
+        buf.truncate()
+
+    try:
+        await _check_exec_price(out, flush)
+    finally:
+        flush()
+
+
+async def _load_orphan_orders():
+    """Исполненные ордера без pair_id (отдельная сессия – запрос идёт параллельно с отчётом)."""
+    async with AsyncSessionLocal() as session:
+        stmt_orphan = select(Order.id, Order.filled, Order.exec_price, Order.status).where(
+            Order.pair_id.is_(None),
+            Order.filled > 0
+        )
+        return (await session.execute(stmt_orphan)).all()
+
+
+async def _check_exec_price(out, flush):
+    # Проверка ордеров без пары не зависит от основного отчёта – запускаем её сразу
+    orphan_task = asyncio.create_task(_load_orphan_orders())
+    try:
+        await _report_pairs(out, flush)
+        orphan_orders = await orphan_task
+    finally:
+        orphan_task.cancel()
+
+    if orphan_orders:
+        out(f"⚠️  ВНИМАНИЕ: Найдено {len(orphan_orders)} ордеров без привязки к паре:")
+        for ord in orphan_orders:
+            out(f"   Order ID={ord.id}: filled={ord.filled}, exec_price={ord.exec_price}, status={ord.status}")
+        out()
+
+
+async def _report_pairs(out, flush):
     async with AsyncSessionLocal() as session:
         # Загружаем справочник алиасов: sec_code -> code
-        stmt_assets = select(Asset).where(Asset.sec_code.isnot(None), Asset.code.isnot(None))
+        stmt_assets = select(Asset.sec_code, Asset.code).where(Asset.sec_code.isnot(None), Asset.code.isnot(None))
         result_assets = await session.execute(stmt_assets)
-        assets = result_assets.scalars().all()
-        ticker_to_alias = {a.sec_code: a.code for a in assets}
+        ticker_to_alias = {sec_code: code for sec_code, code in result_assets}
         
-        print(f"\n📚 Справочник алиасов: {ticker_to_alias}\n")
+        out(f"\n📚 Справочник алиасов: {ticker_to_alias}\n")
         
-        # Получаем все пары с exec_price
-        stmt_pairs = select(Pair).where(Pair.exec_price.isnot(None))
+        # Получаем все пары с exec_price. Отчёт только читает данные, поэтому выбираем
+        # нужные колонки (строки-кортежи), без ORM-объектов и ленивых связей.
+        # Numeric-колонки приводим к float в SQL, а не float(Decimal) в цикле
+        stmt_pairs = select(
+            Pair.id, Pair.asset_1, Pair.asset_2, _as_float(Pair.exec_price), Pair.exec_qty,
+            _as_float(Pair.qty_ratio_1), _as_float(Pair.qty_ratio_2),
+            _as_float(Pair.price_ratio_1), _as_float(Pair.price_ratio_2),
+        ).where(Pair.exec_price.isnot(None)).order_by(Pair.id)
         result = await session.execute(stmt_pairs)
-        pairs = result.scalars().all()
+        pairs = result.all()
         
-        print(f"{'='*80}")
-        print(f"Найдено пар с exec_price: {len(pairs)}")
-        print(f"{'='*80}\n")
+        out(HR80)
+        out(f"Найдено пар с exec_price: {len(pairs)}")
+        out(f"{HR80}\n")
+        
+        # Все исполненные ордера этих пар с инструментами – одним запросом.
+        # Результат читаем потоком пачками по ORDERS_CHUNK строк, отсортированным как пары:
+        # в памяти держим только ордера текущей пары
+        stmt_orders = (
+            select(
+                Order.id, Order.pair_id, Order.filled, _as_float(Order.exec_price), Order.status, Order.side,
+                Instrument.ticker,
+            )
+            .join(Pair, Pair.id == Order.pair_id)
+            .outerjoin(Instrument, Instrument.id == Order.instrument_id)
+            .where(
+                Pair.exec_price.isnot(None),
+                Order.filled > 0
+            )
+            .order_by(Order.pair_id, Order.id)
+            .execution_options(yield_per=ORDERS_CHUNK)
+        )
+        order_rows = aiter(await session.stream(stmt_orders))
+        next_order = await anext(order_rows, None)
         
         for pair in pairs:
-            print(f"\n📊 Пара ID={pair.id}: {pair.asset_1}/{pair.asset_2}")
-            print(f"   БД: exec_price(P&L)={float(pair.exec_price):.2f}, exec_qty={pair.exec_qty}")
+            out(f"\n📊 Пара ID={pair.id}: {pair.asset_1}/{pair.asset_2}")
+            out(f"   БД: exec_price(P&L)={pair.exec_price:.2f}, exec_qty={pair.exec_qty}")
             
             # Коэффициенты
-            qty_ratio_1 = float(pair.qty_ratio_1) if pair.qty_ratio_1 else 1.0
-            qty_ratio_2 = float(pair.qty_ratio_2) if pair.qty_ratio_2 else 1.0
-            price_ratio_1 = float(pair.price_ratio_1) if pair.price_ratio_1 else 1.0
-            price_ratio_2 = float(pair.price_ratio_2) if pair.price_ratio_2 else 1.0
-            print(f"   Коэффициенты: qty_ratio=({qty_ratio_1}, {qty_ratio_2}), price_ratio=({price_ratio_1}, {price_ratio_2})")
+            qty_ratio_1 = pair.qty_ratio_1 or 1.0
+            qty_ratio_2 = pair.qty_ratio_2 or 1.0
+            price_ratio_1 = pair.price_ratio_1 or 1.0
+            price_ratio_2 = pair.price_ratio_2 or 1.0
+            out(f"   Коэффициенты: qty_ratio=({qty_ratio_1}, {qty_ratio_2}), price_ratio=({price_ratio_1}, {price_ratio_2})")
             
-            # Получаем все ордера этой пары с инструментами
-            stmt_orders = select(Order).options(selectinload(Order.instrument)).where(
-                Order.pair_id == pair.id,
-                Order.filled > 0
-            )
-            result_orders = await session.execute(stmt_orders)
-            orders = result_orders.scalars().all()
+            # alias → индекс ноги (0/1); asset_1 кладём последним – при совпадении алиасов он приоритетнее
+            route = {pair.asset_2: 1, pair.asset_1: 0}
+            qty_ratios = (qty_ratio_1, qty_ratio_2)
             
-            print(f"   Ордеров в паре: {len(orders)}")
+            orders = []
+            while next_order is not None and next_order.pair_id == pair.id:
+                orders.append(next_order)
+                next_order = await anext(order_rows, None)
             
-            # Считаем по формуле
-            sum_1 = 0.0
-            sum_2 = 0.0
+            out(f"   Ордеров в паре: {len(orders)}")
+            
+            # Считаем по формуле: acc[0] – нога 1, acc[1] – нога 2
+            acc = [0.0, 0.0]
             
             for i, ord in enumerate(orders, 1):
-                ticker = ord.instrument.ticker if ord.instrument else "?"
+                ticker = ord.ticker or "?"
                 alias = ticker_to_alias.get(ticker, ticker)  # Fallback на ticker если нет в справочнике
                 
-                print(f"\n   Ордер #{i} (ID={ord.id}):")
-                print(f"      ticker={ticker} -> alias={alias}")
-                print(f"      filled={ord.filled}, exec_price={ord.exec_price}")
-                print(f"      status={ord.status}, side={ord.side}")
+                out(f"\n   Ордер #{i} (ID={ord.id}):")
+                out(f"      ticker={ticker} -> alias={alias}")
+                out(f"      filled={ord.filled}, exec_price={ord.exec_price}")
+                out(f"      status={ord.status}, side={ord.side}")
                 
-                if ord.exec_price and ord.filled:
-                    exec_price_float = float(ord.exec_price)
-                    
-                    if alias == pair.asset_1:
-                        normalized = (exec_price_float * ord.filled) / qty_ratio_1
-                        sum_1 += normalized
-                        print(f"      ✓ LEG_1: ({exec_price_float}*{ord.filled})/{qty_ratio_1} = {normalized:.2f}")
-                    elif alias == pair.asset_2:
-                        normalized = (exec_price_float * ord.filled) / qty_ratio_2
-                        sum_2 += normalized
-                        print(f"      ✓ LEG_2: ({exec_price_float}*{ord.filled})/{qty_ratio_2} = {normalized:.2f}")
-                    else:
-                        print(f"      ⚠️  alias={alias} не совпадает с asset_1={pair.asset_1} или asset_2={pair.asset_2}!")
+                filled = ord.filled
+                if ord.exec_price and filled:
+                    exec_price_float = ord.exec_price
+                    try:
+                        leg = route[alias]
+                    except KeyError:
+                        out(f"      ⚠️  alias={alias} не совпадает с asset_1={pair.asset_1} или asset_2={pair.asset_2}!")
+                        continue
+                    qty_ratio = qty_ratios[leg]
+                    normalized = (exec_price_float * filled) / qty_ratio
+                    acc[leg] += normalized
+                    out(f"      ✓ LEG_{leg + 1}: ({exec_price_float}*{filled})/{qty_ratio} = {normalized:.2f}")
                 else:
-                    print(f"      ⚠️  НЕ учтен (exec_price или filled пустые!)")
+                    out(f"      ⚠️  НЕ учтен (exec_price или filled пустые!)")
             
+            sum_1, sum_2 = acc
             if sum_1 > 0 or sum_2 > 0:
                 manual_pnl = sum_1 * price_ratio_1 - sum_2 * price_ratio_2
-                db_pnl = float(pair.exec_price or 0)
+                db_pnl = pair.exec_price or 0.0
                 diff = abs(manual_pnl - db_pnl)
                 
-                print(f"\n   {'─'*60}")
-                print(f"   📈 Расчет P&L вручную:")
-                print(f"      sum_1 (нога 1) = {sum_1:.2f}")
-                print(f"      sum_2 (нога 2) = {sum_2:.2f}")
-                print(f"      P&L = {sum_1:.2f}*{price_ratio_1} - {sum_2:.2f}*{price_ratio_2} = {manual_pnl:.2f}")
-                print(f"\n   БД:             {db_pnl:.2f}")
-                print(f"   Расчет вручную: {manual_pnl:.2f}")
-                print(f"   Разница:        {diff:.2f}")
+                out(f"\n   {HR60}")
+                out(f"   📈 Расчет P&L вручную:")
+                out(f"      sum_1 (нога 1) = {sum_1:.2f}")
+                out(f"      sum_2 (нога 2) = {sum_2:.2f}")
+                out(f"      P&L = {sum_1:.2f}*{price_ratio_1} - {sum_2:.2f}*{price_ratio_2} = {manual_pnl:.2f}")
+                out(f"\n   БД:             {db_pnl:.2f}")
+                out(f"   Расчет вручную: {manual_pnl:.2f}")
+                out(f"   Разница:        {diff:.2f}")
                 
                 if diff > 0.01:
-                    print(f"   ❌ РАСХОЖДЕНИЕ!")
+                    out(f"   ❌ РАСХОЖДЕНИЕ!")
                 else:
-                    print(f"   ✅ Совпадает")
+                    out(f"   ✅ Совпадает")
             else:
-                print(f"\n   ⚠️  Нет исполненных ордеров для расчета")
-        
-        print(f"\n{'='*80}\n")
+                out(f"\n   ⚠️  Нет исполненных ордеров для расчета")
+            flush()
         
-        # Проверяем ордера без pair_id
-        stmt_orphan = select(Order).where(
-            Order.pair_id.is_(None),
-            Order.filled > 0
+        out(f"\n{HR80}\n")
+
+async def find_exec_price_mismatches(session, tolerance: float = 0.01):
+    """Пары, у которых exec_price в БД расходится с пересчётом по ордерам.
+
+    Вся арифметика выполняется в БД: одна строка на пару, без выборки ордеров в Python.
+    """
+    # Алиас ноги: code из assets_table по тикеру, иначе сам тикер
+    alias = func.coalesce(
+        select(Asset.code).where(Asset.sec_code == Instrument.ticker).limit(1).scalar_subquery(),
+        Instrument.ticker,
+    )
+    value = Order.exec_price * Order.filled
+    sum_1 = func.sum(case((alias == Pair.asset_1, value / func.coalesce(func.nullif(Pair.qty_ratio_1, 0), 1)), else_=0))
+    sum_2 = func.sum(case((alias == Pair.asset_2, value / func.coalesce(func.nullif(Pair.qty_ratio_2, 0), 1)), else_=0))
+    computed_pnl = (
+        sum_1 * func.coalesce(func.nullif(Pair.price_ratio_1, 0), 1)
+        - sum_2 * func.coalesce(func.nullif(Pair.price_ratio_2, 0), 1)
+    )
+    stmt = (
+        select(Pair.id, Pair.asset_1, Pair.asset_2, Pair.exec_price, computed_pnl.label("computed_pnl"))
+        .join(Order, Order.pair_id == Pair.id)
+        .join(Instrument, Instrument.id == Order.instrument_id)
+        .where(Pair.exec_price.isnot(None), Order.filled > 0, Order.exec_price.isnot(None))
+        .group_by(Pair.id)
+        .having((sum_1 > 0) | (sum_2 > 0), func.abs(computed_pnl - Pair.exec_price) > tolerance)
+        .order_by(Pair.id)
+    )
+    return (await session.execute(stmt)).all()
+
+
+async def check_exec_price_summary():
+    async with AsyncSessionLocal() as session:
+        rows = await find_exec_price_mismatches(session)
+    lines = [f"Пар с расхождением exec_price: {len(rows)}"]
+    for row in rows:
+        lines.append(
+            f"   ❌ Пара ID={row.id} {row.asset_1}/{row.asset_2}: "
+            f"БД={float(row.exec_price):.2f}, расчет={float(row.computed_pnl):.2f}"
         )
-        result_orphan = await session.execute(stmt_orphan)
-        orphan_orders = result_orphan.scalars().all()
-        
-        if orphan_orders:
-            print(f"⚠️  ВНИМАНИЕ: Найдено {len(orphan_orders)} ордеров без привязки к паре:")
-            for ord in orphan_orders:
-                print(f"   Order ID={ord.id}: filled={ord.filled}, exec_price={ord.exec_price}, status={ord.status}")
-            print()
+    sys.stdout.write("\n".join(lines) + "\n")
+
 
 if __name__ == "__main__":
-    asyncio.run(check_exec_price())
+    if "--summary" in sys.argv[1:]:
+        asyncio.run(check_exec_price_summary())
+    else:
+        asyncio.run(check_exec_price())
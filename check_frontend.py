@@ -1,28 +1,74 @@
 """
 Проверка, что в main.js есть строка с передачей pair_id
 """
+import mmap
+import re
 
-with open('frontend/static/main.js', 'r', encoding='utf-8') as f:
-    content = f.read()
-    
-# Ищем строку с pair_id
-if 'pair_id: row.dataset.id' in content:
-    print("✅ main.js содержит передачу pair_id")
-    
-    # Находим и показываем контекст
-    for i, line in enumerate(content.split('\n'), 1):
-        if 'pair_id:' in line:
+MAIN_JS = 'frontend/static/main.js'
+
+# Один проход по файлу: строки с pair_id и payload с action:'send_pair_order'
+PATTERN = re.compile(rb"""(?P<pair_id>pair_id:)|(?P<send_pair>action:(['"])send_pair_order\3)""")
+PAIR_ID_MARKER = b'pair_id: row.dataset.id'
+PAYLOAD_LINES = 15
+
+
+def _line_bounds(data, pos):
+    """Границы строки (start, end), в которую попадает смещение pos."""
+    start = data.rfind(b'\n', 0, pos) + 1
+    end = data.find(b'\n', pos)
+    return start, (len(data) if end == -1 else end)
+
+
+def _decode(raw):
+    return raw.rstrip(b'\r').decode('utf-8')
+
+
+with open(MAIN_JS, 'rb') as f:
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # пустой файл не отображается в память
+        data = b''
+
+    pair_id_lines = []   # (номер строки, текст)
+    send_pair_at = None  # (номер строки, смещение начала строки)
+    line_no, counted_to = 1, 0
+    last_line = None
+    for m in PATTERN.finditer(data):
+        pos = m.start()
+        # Номер строки считаем инкрементально от предыдущего совпадения
+        line_no += data[counted_to:pos].count(b'\n')
+        counted_to = pos
+        start, end = _line_bounds(data, pos)
+        if m.group('pair_id'):
+            if line_no != last_line:
+                pair_id_lines.append((line_no, _decode(data[start:end])))
+                last_line = line_no
+        elif send_pair_at is None:
+            send_pair_at = (line_no, start)
+
+    # Ищем строку с pair_id
+    if data.find(PAIR_ID_MARKER) != -1:
+        print("✅ main.js содержит передачу pair_id")
+
+        # Показываем контекст
+        for i, line in pair_id_lines:
             print(f"\nСтрока {i}: {line.strip()}")
-else:
-    print("❌ main.js НЕ содержит передачу pair_id!")
-    print("Нужно обновить файл frontend/static/main.js")
-
-# Проверим также строку с action:'send_pair_order'
-lines = content.split('\n')
-for i, line in enumerate(lines):
-    if "action:'send_pair_order'" in line or 'action:"send_pair_order"' in line:
-        print(f"\nНайден payload с send_pair_order на строке {i+1}:")
+    else:
+        print("❌ main.js НЕ содержит передачу pair_id!")
+        print("Нужно обновить файл frontend/static/main.js")
+
+    # Проверим также строку с action:'send_pair_order'
+    if send_pair_at is not None:
+        i, start = send_pair_at
+        print(f"\nНайден payload с send_pair_order на строке {i}:")
         # Показываем 15 строк после (весь payload)
-        for j in range(i, min(i+15, len(lines))):
-            print(f"  {j+1}: {lines[j]}")
-        break
+        for j in range(i, i + PAYLOAD_LINES):
+            if start > len(data):
+                break
+            end = data.find(b'\n', start)
+            end = len(data) if end == -1 else end
+            print(f"  {j}: {_decode(data[start:end])}")
+            start = end + 1
+
+    if isinstance(data, mmap.mmap):
+        data.close()
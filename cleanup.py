@@ -2,17 +2,20 @@
 Скрипт для очистки старых ордеров без привязки к паре.
 """
 import asyncio
-from sqlalchemy import text
+from sqlalchemy import delete
 from db.database import AsyncSessionLocal
+from db.models import Order
 
 async def cleanup():
-    async with AsyncSessionLocal() as session:
-        # Удаляем ордера без pair_id
+    # session.begin(): одна транзакция, commit при выходе и rollback при ошибке
+    async with AsyncSessionLocal() as session, session.begin():
+        # Удаляем ордера без pair_id (скан по частичному индексу ix_orders_pair_id_null)
         result = await session.execute(
-            text("DELETE FROM orders WHERE pair_id IS NULL")
+            delete(Order)
+            .where(Order.pair_id.is_(None))
+            .execution_options(synchronize_session=False)
         )
-        await session.commit()
-        print(f"✓ Удалено старых ордеров: {result.rowcount}")
+    print(f"✓ Удалено старых ордеров: {result.rowcount}")
 
 if __name__ == "__main__":
     asyncio.run(cleanup())
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+from functools import lru_cache
+
 # Pydantic ≥ 2.5: BaseSettings выделен в отдельный пакет
 try:
     from pydantic_settings import BaseSettings  # type: ignore
@@ -33,4 +35,10 @@ class Settings(BaseSettings):
         case_sensitive = False
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Единственный экземпляр Settings: .env читается и валидируется один раз на процесс."""
+    return Settings()
+
+
+settings = get_settings()
@@ -22,6 +22,8 @@ class Broker(Protocol):
     # --- trading
     async def place_market_order(self, tr: dict[str, Any]) -> dict[str, Any]: ...
 
+    async def place_market_orders(self, trs: list[dict[str, Any]]) -> list[dict[str, Any]]: ...
+
     async def place_limit_order(self, tr: dict[str, Any]) -> dict[str, Any]: ...
 
     async def cancel_order(self, order_id: str, class_code: str | None = None, sec_code: str | None = None, *, trans_id: int | None = None) -> dict[str, Any]: ...
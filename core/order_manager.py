@@ -11,22 +11,250 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from sqlalchemy import Float, Integer, bindparam, case, func, select, update
 
 from infra.quik import QuikConnector          # актуальный путь
 from db.database import AsyncSessionLocal     # наш пакет db
-from db.models import Order, OrderStatus, Side, Instrument, Pair
+from db.models import Asset, Order, OrderStatus, Side, Instrument, Pair
+from backend.trading.order_service import get_next_trans_id, next_trans_id
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
 
+# Классы (по префиксу CLASSCODE), где биржа не поддерживает MOVE_ORDERS:
+# акции/фонды режима T+ (TQBR, TQTF, TQPI, ...). Коды классов в QUIK – всегда в верхнем регистре.
+_NO_MOVE_PREFIXES: tuple[str, ...] = ("TQ",)
+
+# Окно накопления сделок: серия частичных исполнений одного ордера
+# пишется в БД одним UPDATE раз в интервал (секунды)
+_FILL_FLUSH_INTERVAL = 0.05
+
+# Сколько ждать OnTransReply по KILL_ORDER перед перевыставлением заявки (секунды)
+_CANCEL_REPLY_TIMEOUT = 0.5
+
+# Числовые статусы OnTransReply QUIK, означающие, что транзакция не выполнена
+# (3 – выполнена; 0/1 – промежуточные)
+_TRANS_REPLY_FAILED = frozenset({2, 4, 5, 6, 10, 11, 12, 13, 14, 16})
+
+# Статус из OnTransReply → итоговый статус ордера. Частые написания перечислены
+# явно, чтобы обычно хватало одного поиска в словаре без str()/upper().
+_STATUS_MAP: Dict[Any, OrderStatus] = {
+    "REJECTED": OrderStatus.REJECTED,
+    "rejected": OrderStatus.REJECTED,
+    "Rejected": OrderStatus.REJECTED,
+    "CANCELLED": OrderStatus.CANCELLED,
+    "cancelled": OrderStatus.CANCELLED,
+    "Cancelled": OrderStatus.CANCELLED,
+}
+
+# instrument_id → (board, ticker). Строки instruments после создания не меняются,
+# поэтому кэш живёт весь процесс и не требует инвалидации.
+_instrument_contracts: Dict[int, tuple[str, str]] = {}
+
+
+async def _get_contract(session, order: Order) -> Optional[tuple[str, str]]:
+    """Возвращает (CLASSCODE, SECCODE) инструмента ордера; в БД – только при промахе кэша."""
+    contract = _instrument_contracts.get(order.instrument_id)
+    if contract is None:
+        row = (await session.execute(_SEL_INSTRUMENT_CONTRACT, {"p_iid": order.instrument_id})).one_or_none()
+        if row is None:
+            return None
+        contract = _instrument_contracts[order.instrument_id] = (row.board, row.ticker)
+    return contract
+
+# Фоновый event-loop для колбэков, пришедших до появления основного цикла.
+# Создаётся один раз по первому требованию и живёт в daemon-потоке.
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_loop_lock = threading.Lock()
+
+
+def _get_bg_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает фоновый event-loop, запуская его поток при первом вызове."""
+    global _bg_loop
+    if _bg_loop is None:
+        with _bg_loop_lock:
+            if _bg_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="OrderManagerLoop", daemon=True).start()
+                _bg_loop = loop
+    return _bg_loop
+
+# ---------------------------------------------------------------------------
+# Подготовленные UPDATE-выражения: строятся один раз при импорте,
+# в колбэках передаём только словарь параметров (без SELECT + ORM-мутации).
+# ---------------------------------------------------------------------------
+
+_p_oid = bindparam("p_oid", type_=Integer)
+_p_qty = bindparam("p_qty", type_=Integer)
+_p_filled = bindparam("p_filled", type_=Integer)
+_p_price = bindparam("p_price", type_=Float)
+_p_status = bindparam("p_status", type_=Order.__table__.c.status.type)
+
+_UPD_PRICE = (
+    update(Order)
+    .where(Order.id == _p_oid)
+    .values(price=_p_price, qty=func.coalesce(_p_qty, Order.qty))
+    .execution_options(synchronize_session=False)
+)
+
+# status / filled необязательны: NULL-параметр оставляет поле как есть
+_UPD_STATUS = (
+    update(Order)
+    .where(Order.id == _p_oid)
+    .values(
+        status=func.coalesce(_p_status, Order.status),
+        filled=func.coalesce(_p_filled, Order.filled),
+        leaves_qty=case(
+            (_p_filled.is_(None), Order.leaves_qty),
+            (Order.qty > _p_filled, Order.qty - _p_filled),
+            else_=0,
+        ),
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# Сделка: filled += qty, пересчёт leaves_qty / VWAP / статуса одним UPDATE.
+# p_price = NULL → exec_price не трогаем (пустая цена или объём в событии).
+_prev_filled = func.coalesce(Order.filled, 0)
+_new_filled = _prev_filled + _p_qty
+_UPD_TRADE = (
+    update(Order)
+    .where(Order.id == _p_oid)
+    .values(
+        filled=_new_filled,
+        leaves_qty=case((Order.qty > _new_filled, Order.qty - _new_filled), else_=0),
+        exec_price=case(
+            (_p_price.is_(None), Order.exec_price),
+            else_=(func.coalesce(Order.exec_price, 0) * _prev_filled + _p_price * _p_qty) / _new_filled,
+        ),
+        # Сделки пишутся с задержкой _FILL_FLUSH_INTERVAL: терминальный статус из
+        # OnTransReply (отмена / отказ), записанный за это время, не перетираем
+        status=case(
+            (Order.status.in_((OrderStatus.CANCELLED, OrderStatus.REJECTED)), Order.status),
+            (_new_filled >= Order.qty, OrderStatus.FILLED),
+            else_=OrderStatus.PARTIAL,
+        ),
+    )
+    .returning(Order.id, Order.filled, Order.exec_price, Order.pair_id)
+    .execution_options(synchronize_session=False)
+)
+
+# Отклонённый KILL_ORDER: снимаем локальную отметку CANCELLED, поставленную
+# cancel_order до ответа биржи, – статус снова по исполнению
+_UPD_UNDO_CANCEL = (
+    update(Order)
+    .where(Order.id == _p_oid, Order.status == OrderStatus.CANCELLED)
+    .values(
+        status=case(
+            (func.coalesce(Order.filled, 0) >= Order.qty, OrderStatus.FILLED),
+            (func.coalesce(Order.filled, 0) > 0, OrderStatus.PARTIAL),
+            else_=OrderStatus.ACTIVE,
+        ),
+    )
+    .execution_options(synchronize_session=False)
+)
+
+# Ордер для cancel_order / modify_order; контракт инструмента – из _instrument_contracts
+_SEL_ORDER = select(Order).where(Order.id == _p_oid)
+
+_SEL_INSTRUMENT_CONTRACT = select(Instrument.board, Instrument.ticker).where(
+    Instrument.id == bindparam("p_iid", type_=Integer)
+)
+
+# Пересчёт пары: исполненные ордера пары, свёрнутые в БД по тикеру инструмента –
+# SUM(exec_price * filled) и SUM(filled) на ногу вместо выборки ORM-объектов ордеров
+_SEL_PAIR_LEGS = (
+    select(
+        Instrument.ticker,
+        func.sum(Order.exec_price * Order.filled, type_=Float).label("notional"),
+        func.sum(Order.filled).label("filled"),
+    )
+    .select_from(Order)
+    .outerjoin(Instrument, Instrument.id == Order.instrument_id)
+    .where(
+        Order.pair_id == bindparam("p_pair_id", type_=Integer),
+        Order.filled > 0,
+        Order.exec_price.isnot(None),
+        Order.exec_price != 0,
+    )
+    .group_by(Instrument.ticker)
+)
+
+_SEL_TICKER_ALIASES = select(Asset.sec_code, Asset.code).where(
+    Asset.sec_code.in_(bindparam("p_tickers", expanding=True))
+)
+
+# sec_code → code (алиас) из assets_table; None – алиаса нет. Справочник редактируется
+# из GUI: маршруты assets сбрасывают кэш (invalidate_ticker_aliases), а _ALIAS_TTL
+# подстраховывает от правок мимо API.
+_ALIAS_TTL = 300.0
+_ticker_aliases: Dict[str, Optional[str]] = {}
+_ticker_aliases_expire_at = 0.0
+
+
+async def _get_ticker_aliases(session, tickers) -> Dict[str, Optional[str]]:
+    """Возвращает кэш алиасов, догружая из БД только отсутствующие в нём тикеры."""
+    global _ticker_aliases_expire_at
+    now = time.monotonic()
+    if now >= _ticker_aliases_expire_at:
+        _ticker_aliases.clear()
+        _ticker_aliases_expire_at = now + _ALIAS_TTL
+    missing = [t for t in tickers if t not in _ticker_aliases]
+    if missing:
+        # Кэш заполняем только по успешному результату: при ошибке запроса
+        # «нет алиаса» не должно закэшироваться
+        result = await session.execute(_SEL_TICKER_ALIASES, {"p_tickers": missing})
+        loaded: Dict[str, Optional[str]] = dict.fromkeys(missing)
+        for sec_code, code in result:
+            if sec_code and code:
+                loaded[sec_code] = code
+        _ticker_aliases.update(loaded)
+    return _ticker_aliases
+
+
+def invalidate_ticker_aliases() -> None:
+    """Сбрасывает кэш алиасов тикеров (после изменения assets_table)."""
+    _ticker_aliases.clear()
+
+
+class _OrderCtx:
+    """Контекст ORM-ордера для KILL_ORDER / MOVE_ORDERS: одна запись вместо набора параллельных dict."""
+
+    __slots__ = ("quik_num", "class_code", "sec_code", "account", "client_code", "order_key")
+
+    def __init__(self) -> None:
+        self.quik_num: Any = None
+        # CLASSCODE & SECCODE
+        self.class_code: Optional[str] = None
+        self.sec_code: Optional[str] = None
+        # ACCOUNT и CLIENT_CODE (нужны для MOVE_ORDERS)
+        self.account: Optional[str] = None
+        self.client_code: Optional[str] = None
+        # ORDER_KEY (внутренний ключ QUIK), который нужен для MOVE_ORDERS
+        self.order_key: Optional[str] = None
+
+
 class OrderManager:
     """Менеджер ордеров: выставление, отмена, отслеживание статусов."""
 
     @staticmethod
     def _to_int(value):
         """Пробует привести значение к int, иначе возвращает как есть."""
+        # Горячий путь: QuikPy отдаёт order_num / trans_id уже числами
+        if value is None or value.__class__ is int:
+            return value
+        # Строка из цифр (TRANS_ID из транзакции) – без try/except
+        if value.__class__ is str and value.isdecimal():
+            return int(value)
+        # Прочее (float, строки с пробелами/знаком, мусор) – как раньше
         try:
-            return int(value) if value is not None else None
+            return int(value)
         except (ValueError, TypeError):
             return value
 
@@ -39,19 +267,32 @@ class OrderManager:
             self._loop = asyncio.get_running_loop()
         except RuntimeError:
             self._loop = None
-        # Маппинг QUIK ID (quik_num) ↔ id ORM Order
+        # Поток, в котором крутится self._loop: по нему _schedule выбирает путь без исключений
+        self._loop_thread_id = threading.get_ident() if self._loop is not None else None
+        # Поток без event-loop, из которого уже приходили события (см. _schedule)
+        self._callback_thread_id: Optional[int] = None
+        # Маппинг QUIK ID (quik_num) → id ORM Order. Ключи нормализуются _to_int,
+        # поэтому во всех местах поиска значение из события тоже приводим через _to_int
         self._quik_to_orm: Dict[int, int] = {}
-        self._orm_to_quik: Dict[int, int] = {}
         # Новый маппинг: trans_id -> orm_order_id
-        self._trans_to_orm: Dict[Any, int] = {}
-        # Сохраняем CLASSCODE & SECCODE для каждого ORM-ордера
-        self._orm_to_contract: Dict[int, tuple[str, str]] = {}
-        # Сохраняем ACCOUNT для каждой заявки (нужно для MOVE_ORDERS)
-        self._orm_to_account: Dict[int, str] = {}
-        # Сохраняем CLIENT_CODE, если есть – нужен для MOVE_ORDERS
-        self._orm_to_client: Dict[int, str] = {}
-        # Сохраняем ORDER_KEY (внутренний ключ QUIK), который нужен для MOVE_ORDERS
-        self._orm_to_order_key: Dict[int, str] = {}
+        self._trans_to_orm: Dict[int, int] = {}
+        # Контекст каждого ORM-ордера: QUIK ID, контракт, счёт, CLIENT_CODE, ORDER_KEY
+        self._orders: Dict[int, _OrderCtx] = {}
+        # trans_id → Future, ожидающий OnTransReply (cancel + new в modify_order)
+        self._pending_replies: Dict[int, asyncio.Future] = {}
+        # TRANS_ID служебных транзакций (KILL_ORDER / MOVE_ORDERS). Они привязаны к
+        # ORM-ордеру, но их отказ – не отказ самой заявки: REJECTED в строку не пишем
+        self._service_trans_ids: set[int] = set()
+        # Накопитель сделок до сброса в БД: orm_order_id → [qty, сумма price*qty, qty с ценой].
+        # Пишется из CallbackThread, читается в event-loop – поэтому под lock.
+        self._fill_deltas: Dict[int, list] = {}
+        self._fill_lock = threading.Lock()
+        self._fill_flush_pending = False
+        # Статусы из OnOrder до записи в БД: orm_order_id → [status, filled] (последние не-None).
+        # Всплеск событий из CallbackThread даёт один переход в event-loop и одну транзакцию.
+        self._status_updates: Dict[int, list] = {}
+        self._status_lock = threading.Lock()
+        self._status_flush_pending = False
         # Подписка на заявки больше не требуется, rely on OnOrder/OnTrade/OnTransReply events
 
         # Совместимость с ранними тестами, где вызываются приватные методы
@@ -73,154 +314,203 @@ class OrderManager:
             om = OrderManager()
         return om
 
+    async def warmup(self) -> int:
+        """
+        Заполняет маппинги незавершёнными ордерами из БД одним запросом.
+
+        После перезапуска заявки прошлой сессии ещё живут в QUIK, а словари
+        пусты – без прогрева их OnOrder/OnTrade терялись бы с предупреждением
+        «Не найден ORM Order». ACCOUNT / CLIENT_CODE / ORDER_KEY в БД не хранятся
+        и дозаполняются первым OnOrder. Возвращает число загруженных ордеров.
+        """
+        stmt = (
+            select(Order.id, Order.trans_id, Order.quik_num, Order.instrument_id,
+                   Instrument.board, Instrument.ticker)
+            .join(Instrument, Order.instrument_id == Instrument.id)
+            .where(Order.status.in_((OrderStatus.NEW, OrderStatus.ACTIVE, OrderStatus.PARTIAL)))
+        )
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(stmt)).all()
+        for orm_order_id, trans_id, quik_num, instrument_id, board, ticker in rows:
+            _instrument_contracts.setdefault(instrument_id, (board, ticker))
+            ctx = self._ctx(orm_order_id)
+            ctx.class_code, ctx.sec_code = board, ticker
+            self._register_trans_mapping(trans_id, orm_order_id)
+            self._register_quik_mapping(quik_num, orm_order_id)
+        logger.info("[OrderManager] warmup: загружено %d активных ордеров", len(rows))
+        return len(rows)
+
+    def _ctx(self, orm_order_id: int) -> _OrderCtx:
+        """Возвращает (создавая при необходимости) контекст ORM-ордера."""
+        ctx = self._orders.get(orm_order_id)
+        if ctx is None:
+            ctx = self._orders[orm_order_id] = _OrderCtx()
+        return ctx
+
     def _register_trans_mapping(self, trans_id: Any, orm_order_id: int):
-        """Сохраняет привязку trans_id → orm_order_id для int и str форматов."""
-        if trans_id is None:
-            return
-        self._trans_to_orm[trans_id] = orm_order_id
-        self._trans_to_orm[str(trans_id)] = orm_order_id
+        """Сохраняет привязку trans_id → orm_order_id (ключ всегда int, см. _to_int)."""
+        key = self._to_int(trans_id)
+        if key.__class__ is int:
+            self._trans_to_orm[key] = orm_order_id
 
-    def _register_quik_mapping(self, quik_num: Any, orm_order_id: int):
-        """Сохраняет привязку quik_num → orm_order_id для int и str форматов."""
-        if quik_num is None:
-            return
-        self._quik_to_orm[quik_num] = orm_order_id
-        self._quik_to_orm[str(quik_num)] = orm_order_id
-        self._orm_to_quik[orm_order_id] = quik_num
+    def _register_service_trans(self, trans_id: int, orm_order_id: int) -> None:
+        """Привязывает TRANS_ID служебной транзакции (KILL_ORDER / MOVE_ORDERS) к ордеру."""
+        self._register_trans_mapping(trans_id, orm_order_id)
+        self._service_trans_ids.add(trans_id)
 
-    async def place_limit_order(self, order_data: dict, orm_order_id: int, strategy_id: int = None) -> Optional[int]:
+    def _register_quik_mapping(self, quik_num: Any, orm_order_id: int):
+        """Сохраняет привязку quik_num → orm_order_id (ключ всегда int, см. _to_int)."""
+        key = self._to_int(quik_num)
+        if key.__class__ is int:
+            self._quik_to_orm[key] = orm_order_id
+            self._ctx(orm_order_id).quik_num = key
+
+    async def place_limit_order(
+        self,
+        order_data: dict,
+        orm_order_id: int,
+        strategy_id: int = None,
+        *,
+        order_fields: Optional[dict] = None,
+    ) -> Optional[int]:
         """
         Выставляет лимитный ордер через QuikConnector.
         order_data — dict с параметрами для QUIK (ACTION, CLASSCODE, SECCODE, PRICE, QUANTITY, ...)
         orm_order_id — id ORM Order, который будет связан с QUIK ID
         strategy_id — id стратегии (если требуется связка)
+        order_fields — поля ORM Order, которые нужно записать вместе с quik_num (одним UPDATE)
         Возвращает QUIK ID (quik_num) или None.
         """
-        # Получаем/вычисляем TRANS_ID
+        # Получаем/вычисляем TRANS_ID. Внутри работаем с int; в транзакцию QUIK
+        # значение уходит строкой – приводим один раз здесь, на границе.
         trans_id_raw = order_data.get("TRANS_ID")
         if trans_id_raw is None:
-            from sqlalchemy.ext.asyncio import AsyncSession
-            from backend.trading.order_service import get_next_trans_id
             async with AsyncSessionLocal() as session:  # type: AsyncSession
-                trans_id_generated = await get_next_trans_id(session)
-            order_data["TRANS_ID"] = str(trans_id_generated)
-            trans_id_raw = trans_id_generated
-        try:
-            trans_id = int(trans_id_raw) if trans_id_raw is not None else None
-        except ValueError:
-            trans_id = None
-        if trans_id is not None:
+                trans_id = await get_next_trans_id(session)
+        else:
+            trans_id = self._to_int(trans_id_raw)
+        if trans_id.__class__ is int:
+            order_data["TRANS_ID"] = str(trans_id)
             self._register_trans_mapping(trans_id, orm_order_id)
+        ctx = self._ctx(orm_order_id)
         # Сохраняем контракт
         class_code = order_data.get("CLASSCODE") or order_data.get("CLASS_CODE")
         sec_code = order_data.get("SECCODE") or order_data.get("SEC_CODE")
         if class_code and sec_code:
-            self._orm_to_contract[orm_order_id] = (class_code, sec_code)
+            ctx.class_code, ctx.sec_code = class_code, sec_code
 
         # Сохраняем торговый счёт
         account = order_data.get("ACCOUNT") or order_data.get("ACCOUNT_ID")
         if account:
-            self._orm_to_account[orm_order_id] = str(account)
+            ctx.account = str(account)
 
         # Сохраняем CLIENT_CODE, если есть – нужен для MOVE_ORDERS
         client_code = order_data.get("CLIENT_CODE")
         if client_code:
-            self._orm_to_client[orm_order_id] = str(client_code)
+            ctx.client_code = str(client_code)
 
         resp = await self._connector.place_limit_order(order_data)
+        fields = dict(order_fields) if order_fields else {}
         quik_num_raw = resp.get("order_num") or resp.get("order_id")
+        quik_num = None
         if quik_num_raw is not None:
             quik_num = int(quik_num_raw)
             self._register_quik_mapping(quik_num, orm_order_id)
-            await self._update_order_quik_num(orm_order_id, quik_num, strategy_id)
-            return quik_num
-        # QUIK не вернул order_num — ждём события OnOrder/OnTransReply, где он придёт.
-        logger.info("place_limit_order: QUIK не вернул order_num, ждём callback-событие")
-        return None
-
-    async def cancel_order(self, orm_order_id: int) -> None:
+            fields["quik_num"] = quik_num
+            if strategy_id is not None:
+                fields["strategy_id"] = strategy_id
+        else:
+            # QUIK не вернул order_num — ждём события OnOrder/OnTransReply, где он придёт.
+            logger.info("place_limit_order: QUIK не вернул order_num, ждём callback-событие")
+        if fields:
+            await self._update_order(orm_order_id, **fields)
+        return quik_num
+
+    async def cancel_order(self, orm_order_id: int, *, trans_id: int | None = None) -> bool:
         """Отменяет ордер по внутреннему id (через маппинг на QUIK ID).
 
-        Создаём новый TRANS_ID для операции отмены, чтобы можно было отследить
-        подтверждение OnTransReply даже если в событии не придёт order_num.
+        Создаём новый TRANS_ID для операции отмены (или используем переданный),
+        чтобы можно было отследить подтверждение OnTransReply даже если в событии
+        не придёт order_num.
+
+        Возвращает True, если KILL_ORDER отправлен с этим TRANS_ID (и по нему
+        придёт OnTransReply), иначе False.
         """
-        order_key = self._orm_to_order_key.get(orm_order_id)
-        quik_num = self._orm_to_quik.get(orm_order_id)
+        ctx = self._orders.get(orm_order_id)
+        order_key = ctx.order_key if ctx else None
+        quik_num = ctx.quik_num if ctx else None
         if order_key is None and quik_num is None:
             logger.warning("Нет ORDER_KEY/QUIK ID для ORM Order %s", orm_order_id)
-            return
+            return False
 
         # Получаем CLASSCODE / SECCODE из ORM
         async with AsyncSessionLocal() as session:
-            order = await session.get(Order, orm_order_id)
+            order = (await session.execute(_SEL_ORDER, {"p_oid": orm_order_id})).scalar_one_or_none()
             if not order:
                 logger.error("Order %s not found while cancelling", orm_order_id)
-                return
-            instrument = await session.get(Instrument, order.instrument_id)
-            if instrument:
-                class_code = instrument.board
-                sec_code = instrument.ticker
+                return False
+            contract = await _get_contract(session, order)
+            if contract:
+                class_code, sec_code = contract
             else:
                 # Fallback: используем сохранённый контракт
-                contract = self._orm_to_contract.get(orm_order_id)
-                if contract:
-                    class_code, sec_code = contract
+                if ctx.class_code and ctx.sec_code:
+                    class_code, sec_code = ctx.class_code, ctx.sec_code
                 else:
                     # Нет данных контракта – пытаемся отменить только по ORDER_KEY (подходит для моков/Dummy)
                     await self._connector.cancel_order(str(order_key or quik_num))  # type: ignore[arg-type]
                     await self._update_order_status(orm_order_id, OrderStatus.CANCELLED)
-                    return
+                    return False
 
-        import random
         # TRANS_ID должен быть положительным 32-битным int (≤ 2_147_483_647)
-        trans_id = random.randint(1, 2_000_000_000)
-        self._register_trans_mapping(trans_id, orm_order_id)
+        if trans_id is None:
+            trans_id = next_trans_id()
+        self._register_service_trans(trans_id, orm_order_id)
         resp = await self._connector.cancel_order(
             str(order_key or quik_num),
             class_code,
             sec_code,
             trans_id=trans_id,
         )
-        logger.info(f"Cancel order response: {resp}")
+        logger.info("Cancel order response: %s", resp)
         # Обновим статус локально – если QUIK подтвердил приём транзакции (resp['data'] == True)
         if resp.get("data") in (True, 1, "1", "True"):
             # status изменится на CANCELLED; filled не трогаем
             await self._update_order_status(orm_order_id, OrderStatus.CANCELLED)
+        return True
 
     async def modify_order(self, orm_order_id: int, new_price: float, new_qty: int | None = None) -> None:
         """Изменяет цену (и при необходимости объём) активного ордера через транзакцию MOVE_ORDERS.
 
         В QUIK изменение заявки выполняется через MOVE_ORDERS с указанием ORDER_KEY и новых параметров.
         """
-        order_key = self._orm_to_order_key.get(orm_order_id)
-        quik_num = self._orm_to_quik.get(orm_order_id)
+        ctx = self._orders.get(orm_order_id)
+        order_key = ctx.order_key if ctx else None
+        quik_num = ctx.quik_num if ctx else None
         if order_key is None and quik_num is None:
             logger.warning("Нет ORDER_KEY/QUIK ID для ORM Order %s", orm_order_id)
             return
 
         # Определяем CLASSCODE / SECCODE
         async with AsyncSessionLocal() as session:
-            order = await session.get(Order, orm_order_id)
+            order = (await session.execute(_SEL_ORDER, {"p_oid": orm_order_id})).scalar_one_or_none()
             if not order:
                 logger.error("Order %s not found while modifying", orm_order_id)
                 return
-            instrument = await session.get(Instrument, order.instrument_id)
-            if instrument:
-                class_code = instrument.board
-                sec_code = instrument.ticker
+            contract = await _get_contract(session, order)
+            if contract:
+                class_code, sec_code = contract
             else:
-                contract = self._orm_to_contract.get(orm_order_id)
-                if not contract:
+                if not (ctx.class_code and ctx.sec_code):
                     logger.error("Не удалось определить CLASS/SECCODE для ордера %s", orm_order_id)
                     return
-                class_code, sec_code = contract
+                class_code, sec_code = ctx.class_code, ctx.sec_code
 
-        account = self._orm_to_account.get(orm_order_id)
-        client_code = self._orm_to_client.get(orm_order_id)
+        account = ctx.account
+        client_code = ctx.client_code
 
-        import random
-        trans_id = random.randint(1, 2_000_000_000)
-        self._register_trans_mapping(trans_id, orm_order_id)
+        trans_id = next_trans_id()
+        self._register_service_trans(trans_id, orm_order_id)
 
         qty_for_move: int | None = new_qty if new_qty is not None else (order.qty if order else None)
 
@@ -231,7 +521,7 @@ class OrderManager:
         # На акциях (класс кода начинается с 'TQ') биржа не поддерживает MOVE_ORDERS,
         # поэтому делаем «отмена + новая заявка». На срочном рынке (SPBFUT, etc.)
         # MOVE_ORDERS сработает быстрее.
-        use_move_orders = bool(class_code) and not str(class_code).upper().startswith("TQ")
+        use_move_orders = bool(class_code) and not class_code.startswith(_NO_MOVE_PREFIXES)
 
         if use_move_orders:
             resp = await self._connector.modify_order(
@@ -259,9 +549,36 @@ class OrderManager:
                 return  # DONE – биржа приняла MOVE_ORDERS
 
             logger.warning("MOVE_ORDERS не принят брокером – fallback to cancel + new")
+            # TRANS_ID уже израсходован на MOVE_ORDERS – для отмены нужен новый
+            trans_id = next_trans_id()
 
         # --- Fallback / Stock market: cancel + new ------------------------------------------------
-        await self.cancel_order(orm_order_id)
+        # Ждём OnTransReply по отмене вместо фиксированной паузы: обычно он приходит
+        # быстрее, а при его отсутствии ограничиваемся таймаутом.
+        # Если MOVE_ORDERS не отправлялся, выделенный выше TRANS_ID идёт на отмену
+        cancel_trans_id = trans_id
+        cancel_reply = asyncio.get_running_loop().create_future()
+        self._pending_replies[cancel_trans_id] = cancel_reply
+        try:
+            if not await self.cancel_order(orm_order_id, trans_id=cancel_trans_id):
+                # KILL_ORDER с этим TRANS_ID не ушёл – ответа не будет, а старая заявка
+                # может быть жива: новую не выставляем, чтобы не удвоить позицию
+                logger.error("Отмена ордера %s не отправлена – перевыставление пропущено", orm_order_id)
+                return
+            reply = await asyncio.wait_for(cancel_reply, timeout=_CANCEL_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Нет OnTransReply по отмене ордера %s за %.1f с – перевыставляем", orm_order_id, _CANCEL_REPLY_TIMEOUT)
+        else:
+            if self._trans_reply_failed(reply):
+                # Отмену отклонили (например, заявка уже исполнена) – новая заявка удвоила бы позицию
+                logger.error(
+                    "KILL_ORDER по ордеру %s отклонён (status=%s, error_code=%s: %s) – перевыставление пропущено",
+                    orm_order_id, reply.get("status"), reply.get("error_code"),
+                    reply.get("result_msg") or reply.get("error_msg"),
+                )
+                return
+        finally:
+            self._pending_replies.pop(cancel_trans_id, None)
 
         # Формируем данные для новой заявки (используем тот же ORM ID)
         new_order_data = {
@@ -275,38 +592,32 @@ class OrderManager:
             "CLIENT_CODE": client_code,
         }
 
-        import random, asyncio as _aio
-        new_order_data["TRANS_ID"] = str(random.randint(1, 2_000_000_000))
+        new_order_data["TRANS_ID"] = next_trans_id()  # строкой его сделает place_limit_order
 
-        # Дадим бирже время обработать отмену (обычно сотни миллисекунд)
-        await _aio.sleep(0.2)
-
-        await self.place_limit_order(new_order_data, orm_order_id)
-
-        # Локально обновляем цену/кол-во сразу
-        await self._update_order_price(orm_order_id, new_price, qty_for_move)
+        # Локально обновляем цену/кол-во сразу – тем же UPDATE, что и quik_num новой заявки.
+        # Строка уже помечена CANCELLED отменой старой заявки: новая заявка живая, иначе
+        # сделки не сдвинут статус (CANCELLED не перетирается) и warmup её пропустит
+        order_fields: dict[str, Any] = {"price": new_price, "status": OrderStatus.ACTIVE}
+        if qty_for_move is not None:
+            order_fields["qty"] = qty_for_move
+        await self.place_limit_order(new_order_data, orm_order_id, order_fields=order_fields)
 
         return
 
     async def _update_order_price(self, orm_order_id: int, price: float, qty: int | None = None) -> None:
         """Обновляет цену и/или объём ордера в БД."""
-        async with AsyncSessionLocal() as session:
-            order = await session.get(Order, orm_order_id)
-            if order:
-                order.price = price
-                if qty is not None:
-                    order.qty = qty
-                await session.commit()
-
-    async def _update_order_quik_num(self, orm_order_id: int, quik_num: int, strategy_id: int = None) -> None:
-        """Обновляет поле quik_num и strategy_id в ORM Order."""
-        async with AsyncSessionLocal() as session:
-            order = await session.get(Order, orm_order_id)
-            if order:
-                order.quik_num = quik_num
-                if strategy_id is not None:
-                    order.strategy_id = strategy_id
-                await session.commit()
+        async with AsyncSessionLocal.begin() as session:
+            await session.execute(_UPD_PRICE, {"p_oid": orm_order_id, "p_price": price, "p_qty": qty})
+
+    async def _update_order(self, orm_order_id: int, **fields: Any) -> None:
+        """Записывает произвольный набор полей ORM Order одним UPDATE (без SELECT)."""
+        async with AsyncSessionLocal.begin() as session:
+            await session.execute(
+                update(Order)
+                .where(Order.id == orm_order_id)
+                .values(**fields)
+                .execution_options(synchronize_session=False)
+            )
 
     async def _update_order_status(self, orm_order_id: int, status: OrderStatus | None, filled: int = None) -> None:
         """Обновляет статус, исполненный объём и leaves_qty ордера в БД.
@@ -314,65 +625,37 @@ class OrderManager:
         Если `status` равен None, статус ордера не изменяется (некоторые события OnOrder не
         содержат поля status).
         """
-        async with AsyncSessionLocal() as session:
-            order = await session.get(Order, orm_order_id)
-            if order:
-                if status is not None:  # обновляем только если передан
-                    order.status = status
-                if filled is not None:
-                    order.filled = filled
-                    # Корректно рассчитываем leaves_qty
-                    order.leaves_qty = max(order.qty - order.filled, 0)
-                await session.commit()
+        async with AsyncSessionLocal.begin() as session:
+            await session.execute(
+                _UPD_STATUS,
+                {"p_oid": orm_order_id, "p_status": status, "p_filled": filled},
+            )
     
-    async def _update_pair_exec_price(self, session, order: Order) -> None:
+    async def _update_pair_exec_price(self, session, pair_id: int) -> Optional[tuple[int, float, int]]:
         """Обновляет exec_price и exec_qty в таблице Pair на основе реальных сделок по ордерам.
         
+        Изменения остаются в транзакции вызывающего (commit делает он); возвращает
+        (pair_id, exec_price, exec_qty) для рассылки или None, если пара не пересчитана.
+        
         Формула расчета exec_price (P&L спреда):
         exec_price = SUM(price_1 * qty_1 / qty_ratio_1) * price_ratio_1
                    - SUM(price_2 * qty_2 / qty_ratio_2) * price_ratio_2
         
         Нога определяется через справочник assets_table: ticker -> alias (code)
         """
-        if not order.pair_id:
-            return  # Ордер не связан с парой
-        
-        from sqlalchemy import select
-        from sqlalchemy.orm import selectinload
-        from db.models import Asset
-        
         # Получаем Pair с параметрами
-        pair = await session.get(Pair, order.pair_id)
+        pair = await session.get(Pair, pair_id)
         if not pair:
-            return
+            return None
         
-        # Получаем все ордера этой пары с исполненными сделками (с загрузкой instrument)
-        stmt = select(Order).options(selectinload(Order.instrument)).where(
-            Order.pair_id == order.pair_id,
-            Order.filled > 0,
-            Order.exec_price.isnot(None)
-        )
-        result = await session.execute(stmt)
-        orders = result.scalars().all()
+        # Суммы по тикерам исполненных ордеров пары (агрегация в БД)
+        legs = (await session.execute(_SEL_PAIR_LEGS, {"p_pair_id": pair_id})).all()
         
-        if not orders:
-            return
-        
-        # Собираем все тикеры и загружаем их алиасы из assets_table
-        tickers = set()
-        for ord in orders:
-            if ord.instrument and ord.instrument.ticker:
-                tickers.add(ord.instrument.ticker)
+        if not legs:
+            return None
         
         # Получаем маппинг sec_code -> code (алиас) из assets_table
-        ticker_to_alias = {}
-        if tickers:
-            stmt_assets = select(Asset).where(Asset.sec_code.in_(tickers))
-            result_assets = await session.execute(stmt_assets)
-            assets = result_assets.scalars().all()
-            for asset in assets:
-                if asset.sec_code and asset.code:
-                    ticker_to_alias[asset.sec_code] = asset.code
+        ticker_to_alias = await _get_ticker_aliases(session, {ticker for ticker, _, _ in legs if ticker})
         
         # Получаем коэффициенты из Pair (с дефолтами)
         qty_ratio_1 = float(pair.qty_ratio_1) if pair.qty_ratio_1 else 1.0
@@ -385,24 +668,18 @@ class OrderManager:
         sum_2 = 0.0  # SUM(price_2 * qty_2 / qty_ratio_2)
         exec_qty = 0  # Количество исполненных по ноге 1
         
-        for ord in orders:
-            if not ord.exec_price or not ord.filled:
-                continue
-            
-            exec_price_float = float(ord.exec_price)
-            ticker = ord.instrument.ticker if ord.instrument else None
+        asset_1, asset_2 = pair.asset_1, pair.asset_2
+        for ticker, notional, filled in legs:
             alias = ticker_to_alias.get(ticker)
             
             # Определяем ногу по алиасу
-            if alias == pair.asset_1:
-                normalized = (exec_price_float * ord.filled) / qty_ratio_1
-                sum_1 += normalized
-                exec_qty += ord.filled
-            elif alias == pair.asset_2:
-                normalized = (exec_price_float * ord.filled) / qty_ratio_2
-                sum_2 += normalized
+            if alias == asset_1:
+                sum_1 += notional / qty_ratio_1
+                exec_qty += filled
+            elif alias == asset_2:
+                sum_2 += notional / qty_ratio_2
             else:
-                logger.warning(f"[PAIR] Order {ord.id}: alias={alias} не совпадает с парой {pair.asset_1}/{pair.asset_2}")
+                logger.warning("[PAIR] Pair %s: ticker=%s alias=%s не совпадает с парой %s/%s", pair_id, ticker, alias, asset_1, asset_2)
         
         # Итоговый P&L спреда
         pnl = sum_1 * price_ratio_1 - sum_2 * price_ratio_2
@@ -410,32 +687,34 @@ class OrderManager:
         # Обновляем Pair
         pair.exec_qty = exec_qty
         pair.exec_price = pnl
-        await session.commit()
-        print(f"[PAIR] Pair {pair.id}: exec_price={pnl:.2f}, exec_qty={exec_qty}")
-        
-        # Отправляем обновление через WebSocket всем клиентам
+        return pair.id, pnl, exec_qty
+
+    @staticmethod
+    async def _broadcast_pair_update(pair_id: int, pnl: float, exec_qty: int) -> None:
+        """Отправляет обновление пары через WebSocket всем клиентам."""
         try:
+            # Импорт остаётся ленивым: backend.api.ws → core.ws_actions → config → core.order_manager
             from backend.api.ws import ws_manager
             await ws_manager.broadcast({
                 "type": "pair_update",
-                "pair_id": pair.id,
+                "pair_id": pair_id,
                 "exec_price": float(pnl),
                 "exec_qty": exec_qty
             })
         except Exception as e:
-            print(f"[PAIR] Ошибка broadcast: {e}")
+            logger.error("[PAIR] Ошибка broadcast: %s", e)
 
     def _find_orm_order_id(self, event: dict) -> Optional[int]:
         """
         Универсальный поиск ORM Order ID по event: сначала по trans_id, потом по quik_num.
         """
-        trans_id = event.get("trans_id") or event.get("TRANS_ID")
-        quik_num = event.get("order_num") or event.get("order_id")
-        if quik_num is not None and quik_num in self._quik_to_orm:
-            return self._quik_to_orm[quik_num]
-        if trans_id is not None and trans_id in self._trans_to_orm:
-            return self._trans_to_orm[trans_id]
-        return None
+        trans_id = self._to_int(event.get("trans_id") or event.get("TRANS_ID"))
+        quik_num = self._to_int(event.get("order_num") or event.get("order_id"))
+        # trans_id чаще: после cancel/replace QUIK отвечает по свежему TRANS_ID раньше order_num
+        orm_order_id = self._trans_to_orm.get(trans_id) if trans_id is not None else None
+        if orm_order_id is None and quik_num is not None:
+            orm_order_id = self._quik_to_orm.get(quik_num)
+        return orm_order_id
 
     def on_order_event(self, event: dict):
         """
@@ -443,39 +722,68 @@ class OrderManager:
         Если ордер найден только по trans_id, обновляем его QUIK_ID.
         """
         order_key_val = event.get("order_key") or event.get("ORDER_KEY")
+        order_key_num = self._to_int(order_key_val)
         quik_num = self._to_int(event.get("order_id") or event.get("order_num"))
         trans_id = self._to_int(event.get("trans_id") or event.get("TRANS_ID"))
-        orm_order_id = None
-        if order_key_val is not None and order_key_val in self._quik_to_orm:
-            orm_order_id = self._quik_to_orm[order_key_val]
-        elif quik_num is not None and quik_num in self._quik_to_orm:
-            orm_order_id = self._quik_to_orm[quik_num]
-        elif trans_id is not None and trans_id in self._trans_to_orm:
-            orm_order_id = self._trans_to_orm[trans_id]
+        orm_order_id = self._quik_to_orm.get(order_key_num) if order_key_num is not None else None
+        if orm_order_id is None and quik_num is not None:
+            orm_order_id = self._quik_to_orm.get(quik_num)
+        if orm_order_id is None and trans_id is not None:
+            orm_order_id = self._trans_to_orm.get(trans_id)
             # Если появился новый quik_num, связываем с ORM-ордером
-            if quik_num is not None and quik_num not in self._quik_to_orm:
+            if orm_order_id is not None and quik_num is not None:
                 self._register_quik_mapping(quik_num, orm_order_id)
         if orm_order_id is None:
-            logger.warning(f"[ORDER_EVENT] Не найден ORM Order для QUIK ID {quik_num} или TRANS_ID {trans_id}")
+            logger.warning("[ORDER_EVENT] Не найден ORM Order для QUIK ID %s или TRANS_ID %s", quik_num, trans_id)
             return
         status = event.get("status")
         filled = event.get("filled")
 
         # --- сохраняем ACCOUNT / CLIENT_CODE, если появились в callback'е ---
         if orm_order_id is not None:
+            ctx = self._ctx(orm_order_id)
             acc = event.get("ACCOUNT") or event.get("ACCOUNT_ID") or event.get("account")
-            if acc and orm_order_id not in self._orm_to_account:
-                self._orm_to_account[orm_order_id] = str(acc)
+            if acc and ctx.account is None:
+                ctx.account = str(acc)
 
             client_code_cb = event.get("CLIENT_CODE") or event.get("client_code")
-            if client_code_cb and orm_order_id not in self._orm_to_client:
-                self._orm_to_client[orm_order_id] = str(client_code_cb)
+            if client_code_cb and ctx.client_code is None:
+                ctx.client_code = str(client_code_cb)
 
             # ORDER_KEY
-            if order_key_val:
-                self._orm_to_order_key.setdefault(orm_order_id, str(order_key_val))
-
-        self._schedule(self._update_order_status(orm_order_id, status, filled))
+            if order_key_val and ctx.order_key is None:
+                ctx.order_key = str(order_key_val)
+
+        # Сливаем с ещё не записанным событием этого ордера: так же, как последовательные
+        # _UPD_STATUS, None не затирает ранее пришедшее значение
+        with self._status_lock:
+            pending = self._status_updates.get(orm_order_id)
+            if pending is None:
+                self._status_updates[orm_order_id] = [status, filled]
+            else:
+                if status is not None:
+                    pending[0] = status
+                if filled is not None:
+                    pending[1] = filled
+            if self._status_flush_pending:
+                return
+            self._status_flush_pending = True
+        self._schedule(self._flush_statuses())
+
+    async def _flush_statuses(self) -> None:
+        """Пишет накопленные статусы OnOrder: один UPDATE на ордер, один commit на пачку."""
+        with self._status_lock:
+            batch, self._status_updates = self._status_updates, {}
+            self._status_flush_pending = False
+        try:
+            async with AsyncSessionLocal.begin() as session:
+                for orm_order_id, (status, filled) in batch.items():
+                    await session.execute(
+                        _UPD_STATUS,
+                        {"p_oid": orm_order_id, "p_status": status, "p_filled": filled},
+                    )
+        except Exception as e:
+            logger.error("[ORDER_EVENT] ОШИБКА при записи статусов %s: %s", list(batch), e)
 
     def on_trade_event(self, event: dict):
         """
@@ -484,55 +792,73 @@ class OrderManager:
         quik_num = self._to_int(event.get("order_num") or event.get("order_id"))
         trans_id = self._to_int(event.get("trans_id") or event.get("TRANS_ID"))
         
-        orm_order_id = None
-        if quik_num is not None and quik_num in self._quik_to_orm:
-            orm_order_id = self._quik_to_orm[quik_num]
-        elif trans_id is not None and trans_id in self._trans_to_orm:
-            orm_order_id = self._trans_to_orm[trans_id]
+        # Один probe на словарь вместо «in» + индексации
+        orm_order_id = self._quik_to_orm.get(quik_num) if quik_num is not None else None
+        if orm_order_id is None and trans_id is not None:
+            orm_order_id = self._trans_to_orm.get(trans_id)
         
         if orm_order_id is None:
-            logger.warning(f"[TRADE] Не найден ORM Order для QUIK ID {quik_num} или TRANS_ID {trans_id}")
+            logger.warning("[TRADE] Не найден ORM Order для QUIK ID %s или TRANS_ID %s", quik_num, trans_id)
             return
         
-        async def update():
-            try:
-                async with AsyncSessionLocal() as session:
-                    order = await session.get(Order, orm_order_id)
-                    if order:
-                        # Получаем данные сделки
-                        trade_qty = event.get("qty") or 0
-                        trade_price = event.get("price") or 0.0
-                        
-                        # Обновляем filled quantity
-                        prev_filled = order.filled or 0
-                        order.filled = prev_filled + trade_qty
-                        order.leaves_qty = max(order.qty - order.filled, 0)
-                        
-                        # Рассчитываем weighted average execution price
-                        if trade_qty > 0 and trade_price > 0:
-                            prev_exec_price = float(order.exec_price) if order.exec_price else 0.0
-                            trade_price_float = float(trade_price)
-                            if prev_filled == 0:
-                                order.exec_price = trade_price_float
-                            else:
-                                total_cost = (prev_exec_price * prev_filled) + (trade_price_float * trade_qty)
-                                order.exec_price = total_cost / order.filled
-                        
-                        # Обновляем статус
-                        if order.filled >= order.qty:
-                            order.status = OrderStatus.FILLED
-                        else:
-                            order.status = OrderStatus.PARTIAL
-                        
-                        await session.commit()
-                        print(f"[TRADE] Order {order.id}: +{trade_qty}@{trade_price} -> filled={order.filled}, exec_price={order.exec_price:.2f}")
-                        
-                        # Обновляем Pair.exec_price если ордер связан с парой
-                        await self._update_pair_exec_price(session, order)
-            except Exception as e:
-                print(f"[TRADE] ОШИБКА Order {orm_order_id}: {e}")
-        
-        self._schedule(update())
+        # Получаем данные сделки
+        trade_qty = event.get("qty") or 0
+        trade_price = event.get("price") or 0.0
+        # Копим сделку в памяти; weighted average считаем только по валидным сделкам
+        with self._fill_lock:
+            acc = self._fill_deltas.get(orm_order_id)
+            if acc is None:
+                acc = self._fill_deltas[orm_order_id] = [0, 0.0, 0]
+            acc[0] += trade_qty
+            if trade_qty > 0 and trade_price > 0:
+                acc[1] += float(trade_price) * trade_qty
+                acc[2] += trade_qty
+            if self._fill_flush_pending:
+                return
+            self._fill_flush_pending = True
+        self._schedule(self._flush_fills())
+
+    async def _flush_fills(self) -> None:
+        """Через _FILL_FLUSH_INTERVAL пишет накопленные сделки: один UPDATE на ордер, один commit."""
+        await asyncio.sleep(_FILL_FLUSH_INTERVAL)
+        with self._fill_lock:
+            batch, self._fill_deltas = self._fill_deltas, {}
+            self._fill_flush_pending = False
+        try:
+            # Ордера и пересчёт пар – одна транзакция и один commit на всю пачку
+            async with AsyncSessionLocal() as session, session.begin():
+                rows = []
+                for orm_order_id, (qty, notional, priced_qty) in batch.items():
+                    params = {
+                        "p_oid": orm_order_id,
+                        "p_qty": qty,
+                        # VWAP пачки; NULL → exec_price не трогаем
+                        "p_price": notional / priced_qty if priced_qty else None,
+                    }
+                    row = (await session.execute(_UPD_TRADE, params)).one_or_none()
+                    if row is not None:
+                        rows.append((row, qty))
+                pair_ids = set()
+                for row, qty in rows:
+                    logger.debug("[TRADE] Order %s: +%s -> filled=%s, exec_price=%.2f",
+                                 row.id, qty, row.filled, row.exec_price or 0)
+                    if row.pair_id:  # ордера вне пар не пересчитываем
+                        pair_ids.add(row.pair_id)
+
+                # Обновляем Pair.exec_price для пар, затронутых пачкой
+                pair_updates = []
+                for pair_id in pair_ids:
+                    pair_update = await self._update_pair_exec_price(session, pair_id)
+                    if pair_update is not None:
+                        pair_updates.append(pair_update)
+        except Exception as e:
+            logger.error("[TRADE] ОШИБКА при записи сделок %s: %s", list(batch), e)
+            return
+
+        # Рассылаем клиентам только закоммиченные значения
+        for pair_id, pnl, exec_qty in pair_updates:
+            logger.debug("[PAIR] Pair %s: exec_price=%.2f, exec_qty=%s", pair_id, pnl, exec_qty)
+            await self._broadcast_pair_update(pair_id, pnl, exec_qty)
 
     def on_trans_reply_event(self, event: dict):
         """
@@ -542,47 +868,101 @@ class OrderManager:
         """
         trans_id = self._to_int(event.get("trans_id") or event.get("TRANS_ID"))
         quik_num = self._to_int(event.get("order_num") or event.get("order_id"))
-        orm_order_id = None
-        if trans_id is not None and trans_id in self._trans_to_orm:
-            orm_order_id = self._trans_to_orm[trans_id]
-        elif quik_num is not None and quik_num in self._quik_to_orm:
-            orm_order_id = self._quik_to_orm[quik_num]
+        # Будим modify_order, ожидающий подтверждения отмены
+        reply_fut = self._pending_replies.pop(trans_id, None) if trans_id is not None else None
+        if reply_fut is not None:
+            reply_fut.get_loop().call_soon_threadsafe(self._resolve_reply, reply_fut, event)
+        orm_order_id = self._trans_to_orm.get(trans_id) if trans_id is not None else None
+        if orm_order_id is None and quik_num is not None:
+            orm_order_id = self._quik_to_orm.get(quik_num)
         if orm_order_id is None:
-            logger.warning(f"[TRANS_REPLY] Не найден ORM Order для QUIK ID {quik_num} или TRANS_ID {trans_id}")
+            logger.warning("[TRANS_REPLY] Не найден ORM Order для QUIK ID %s или TRANS_ID %s", quik_num, trans_id)
             return
         # Если появился новый quik_num, связываем с ORM-ордером
         if quik_num is not None and quik_num not in self._quik_to_orm:
             self._register_quik_mapping(quik_num, orm_order_id)
         status_raw = event.get("status")
-        status_norm = str(status_raw).upper() if status_raw is not None else ""
+        status_mapped = _STATUS_MAP.get(status_raw)
+        if status_mapped is None and status_raw is not None:
+            status_mapped = _STATUS_MAP.get(str(status_raw).upper())
         error_code = event.get("error_code")
         error_msg = event.get("error_msg")
+        if (error_code not in (0, None, "0", "")) or status_mapped is OrderStatus.REJECTED:
+            if trans_id in self._service_trans_ids:
+                # Отклонена отмена / перестановка (например, заявка уже исполнена) –
+                # сама заявка не отвергнута, её статус не трогаем
+                self._service_trans_ids.discard(trans_id)
+                logger.warning("[TRANS_REPLY] Служебная транзакция %s по ордеру %s отклонена: %s %s",
+                               trans_id, orm_order_id, error_code, error_msg)
+                self._schedule(self._undo_local_cancel(orm_order_id))
+                return
+            new_status = OrderStatus.REJECTED
+        elif status_mapped is OrderStatus.CANCELLED:
+            new_status = OrderStatus.CANCELLED
+        else:
+            return  # статус не меняется – в БД идти незачем
         async def update():
-            async with AsyncSessionLocal() as session:
-                order = await session.get(Order, orm_order_id)
-                if order:
-                    if (error_code not in (0, None, "0", "")) or status_norm == "REJECTED":
-                        order.status = OrderStatus.REJECTED
-                        logger.error(f"[TRANS_REPLY] Order {order.id} REJECTED: {error_code} {error_msg}")
-                    elif status_norm == "CANCELLED":
-                        order.status = OrderStatus.CANCELLED
-                        logger.info(f"[TRANS_REPLY] Order {order.id} CANCELLED")
-                    await session.commit()
+            async with AsyncSessionLocal.begin() as session:
+                result = await session.execute(
+                    _UPD_STATUS,
+                    {"p_oid": orm_order_id, "p_status": new_status, "p_filled": None},
+                )
+            if not result.rowcount:
+                return
+            if new_status is OrderStatus.REJECTED:
+                logger.error("[TRANS_REPLY] Order %s REJECTED: %s %s", orm_order_id, error_code, error_msg)
+            else:
+                logger.info("[TRANS_REPLY] Order %s CANCELLED", orm_order_id)
         self._schedule(update())
 
+    async def _undo_local_cancel(self, orm_order_id: int) -> None:
+        """Возвращает статус по исполнению, если отмена, отмеченная локально, отклонена."""
+        try:
+            async with AsyncSessionLocal.begin() as session:
+                await session.execute(_UPD_UNDO_CANCEL, {"p_oid": orm_order_id})
+        except Exception as e:
+            logger.error("[TRANS_REPLY] Ошибка восстановления статуса ордера %s: %s", orm_order_id, e)
+
+    @staticmethod
+    def _trans_reply_failed(event: dict) -> bool:
+        """True, если OnTransReply сообщает, что транзакция не выполнена."""
+        if event.get("error_code") not in (0, None, "0", ""):
+            return True
+        status = event.get("status")
+        if _STATUS_MAP.get(status) is OrderStatus.REJECTED:
+            return True
+        try:
+            return int(status) in _TRANS_REPLY_FAILED
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def _resolve_reply(fut: asyncio.Future, event: dict) -> None:
+        """Завершает Future ожидания OnTransReply (вызывается в потоке event-loop)."""
+        if not fut.done():
+            fut.set_result(event)
+
     def _schedule(self, coro):
         """Безопасно запускает coroutine из любого потока."""
-        try:
-            # Если уже внутри работающего цикла
-            loop = asyncio.get_running_loop()
-            return loop.create_task(coro)
-        except RuntimeError:
-            # Мы в другом потоке; используем сохранённый loop
-            if self._loop and self._loop.is_running():
-                return asyncio.run_coroutine_threadsafe(coro, self._loop)
-            # Fallback: выполняем синхронно в отдельном временном цикле (нежелательно, но надёжно)
-            new_loop = asyncio.new_event_loop()
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            # Уже внутри работающего цикла
+            if threading.get_ident() == self._loop_thread_id:
+                return loop.create_task(coro)
+            # Мы в другом потоке (CallbackThread QuikPy) – основной путь для событий QUIK
+            return asyncio.run_coroutine_threadsafe(coro, loop)
+        # Loop не сохранён (OrderManager создан вне event-loop)
+        ident = threading.get_ident()
+        if ident != self._callback_thread_id:
             try:
-                return new_loop.run_until_complete(coro)
-            finally:
-                new_loop.close() 
\ No newline at end of file
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                # Поток без цикла (CallbackThread QuikPy) – запоминаем его, чтобы
+                # следующие события из него шли сразу в фоновый цикл без исключения
+                self._callback_thread_id = ident
+            else:
+                # Вызваны из работающего цикла – запоминаем его для последующих событий
+                self._loop, self._loop_thread_id = running, ident
+                return running.create_task(coro)
+        # Fallback: фоновый цикл, общий для всех вызовов (не блокирует поток колбэка)
+        return asyncio.run_coroutine_threadsafe(coro, _get_bg_loop())
@@ -6,14 +6,21 @@ backend.api.ws только маршрутизировал сообщения.
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Callable, Dict, Tuple
+import logging
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
 
 from core.broker import Broker
 # for TRANS_ID generation and mapping
 from db.database import AsyncSessionLocal
-from backend.trading.order_service import get_next_trans_id
+from backend.trading.order_service import allocate_trans_ids, get_next_trans_id, get_next_trans_ids
 from config import container
 
+if TYPE_CHECKING:
+    from core.order_manager import OrderManager
+
+logger = logging.getLogger(__name__)
+
 # Тип callback котировки
 QuoteCallback = Callable[[Dict[str, Any]], None]
 
@@ -22,25 +29,81 @@ QuoteCallback = Callable[[Dict[str, Any]], None]
 # Подписка на котировки
 # ---------------------------------------------------------------------------
 
+# Брокер по умолчанию – singleton контейнера: создаётся при первой заявке/подписке
+# без явного broker (не при импорте модуля) и дальше переиспользуется
+_broker: Optional[Broker] = None
+
+
 def _get_broker() -> Broker:
-    """Ленивое получение брокера из DI-контейнера."""
-    return container.broker()
+    """Ленивое получение брокера из DI-контейнера (с кэшированием)."""
+    global _broker
+    if _broker is None:
+        _broker = container.broker()
+    return _broker
+
+
+# OrderManager – singleton контейнера: разрешаем его один раз, а не на каждой заявке
+_order_manager: Optional[OrderManager] = None
+
+
+def _get_order_manager() -> OrderManager:
+    """Ленивое получение OrderManager из DI-контейнера (с кэшированием)."""
+    global _order_manager
+    if _order_manager is None:
+        _order_manager = container.order_manager()
+    return _order_manager
+
+
+def _with_default_broker(fn):
+    """Подставляет брокер из DI-контейнера, если вызывающий не передал свой.
+
+    Функции ниже получают `broker` уже разрешённым; снаружи он остаётся
+    необязательным keyword-аргументом (`broker=None`).
+    """
+    if asyncio.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def wrapper(*args, broker: Broker | None = None, **kwargs):
+            return await fn(*args, broker=broker or _get_broker(), **kwargs)
+    else:
+        @wraps(fn)
+        def wrapper(*args, broker: Broker | None = None, **kwargs):
+            return fn(*args, broker=broker or _get_broker(), **kwargs)
+    return wrapper
 
 
-def start_quotes(class_code: str, sec_code: str, cb: QuoteCallback, broker: Broker | None = None) -> None:  # noqa: D401
+@_with_default_broker
+def start_quotes(class_code: str, sec_code: str, cb: QuoteCallback, *, broker: Broker) -> None:  # noqa: D401
     """Подписаться на стакан L2."""
-    (broker or _get_broker()).subscribe_quotes(class_code, sec_code, cb)
+    broker.subscribe_quotes(class_code, sec_code, cb)
 
 
-def stop_quotes(class_code: str, sec_code: str, cb: QuoteCallback, broker: Broker | None = None) -> None:  # noqa: D401
-    (broker or _get_broker()).unsubscribe_quotes(class_code, sec_code, cb)
+@_with_default_broker
+def stop_quotes(class_code: str, sec_code: str, cb: QuoteCallback, *, broker: Broker) -> None:  # noqa: D401
+    broker.unsubscribe_quotes(class_code, sec_code, cb)
 
 
 # ---------------------------------------------------------------------------
 # Отправка одиночного ордера
 # ---------------------------------------------------------------------------
 
-async def send_order(data: Dict[str, Any], broker: Broker | None = None) -> Dict[str, Any]:  # noqa: D401
+# Шаблон транзакции NEW_ORDER: заявка – копия шаблона с заполнением полей
+# (все ключи сразу на месте, словарь не перестраивается при добавлении)
+_ORDER_TEMPLATE: Dict[str, Any] = {
+    "ACTION": "NEW_ORDER",
+    "CLASSCODE": None,
+    "SECCODE": None,
+    "ACCOUNT": None,
+    "CLIENT_CODE": None,
+    "OPERATION": None,
+    "QUANTITY": "0",
+    "PRICE": "0",
+    "TYPE": "L",
+    "TRANS_ID": None,
+}
+
+
+@_with_default_broker
+async def send_order(data: Dict[str, Any], *, broker: Broker) -> Dict[str, Any]:  # noqa: D401
     """Отправляет одиночный лимитный или рыночный ордер через QuikConnector."""
     order_type = data.get("order_type", "L")  # 'L' | 'M'
     
@@ -48,32 +111,34 @@ async def send_order(data: Dict[str, Any], broker: Broker | None = None) -> Dict
     quantity = data.get("quantity", 0)
     price = data.get("price", 0)
     
-    order = {
-        "ACTION": "NEW_ORDER",
-        "CLASSCODE": data.get("class_code"),
-        "SECCODE": data.get("sec_code"),
-        "ACCOUNT": data.get("account"),
-        "CLIENT_CODE": data.get("client_code"),
-        "OPERATION": data.get("operation"),
-        "QUANTITY": str(quantity) if quantity is not None else "0",
-    }
+    order = _ORDER_TEMPLATE.copy()
+    order["CLASSCODE"] = data.get("class_code")
+    order["SECCODE"] = data.get("sec_code")
+    order["ACCOUNT"] = data.get("account")
+    order["CLIENT_CODE"] = data.get("client_code")
+    order["OPERATION"] = data.get("operation")
+    order["QUANTITY"] = str(quantity) if quantity is not None else "0"
     if order_type == "M":
-        order.update({"PRICE": "0", "TYPE": "M"})
+        order["TYPE"] = "M"
     else:
-        order.update({"PRICE": str(price) if price is not None else "0", "TYPE": "L"})
+        order["PRICE"] = str(price) if price is not None else "0"
 
-    async with AsyncSessionLocal() as sess:
-        next_id = await get_next_trans_id(sess)
+    # Счётчик засеян при старте приложения – номер выдаётся в памяти, без сессии БД
+    try:
+        next_id = allocate_trans_ids(1)[0]
+    except RuntimeError:  # засев при старте не выполнился – засеваем из БД сейчас
+        async with AsyncSessionLocal() as sess:
+            next_id = await get_next_trans_id(sess)
     order["TRANS_ID"] = str(next_id)
 
     # --- register mapping in OrderManager so callbacks find ORM ----
+    # Сама регистрация – запись в dict без lock и IO; guard только на случай, если
+    # OrderManager не создаётся: заявка всё равно уходит, WS-сессия не рвётся
     try:
-        om = container.order_manager()
-        om._register_trans_mapping(next_id, -1)  # -1: no ORM row yet
-    except Exception:
-        pass
+        _get_order_manager()._register_trans_mapping(next_id, -1)  # -1: no ORM row yet
+    except Exception as exc:  # pragma: no cover
+        logger.warning("send_order: не удалось зарегистрировать TRANS_ID %s: %s", next_id, exc)
 
-    broker = broker or _get_broker()
     if order_type == "M":
         return await broker.place_market_order(order)  # type: ignore[return-value]
     return await broker.place_limit_order(order)  # type: ignore[return-value]
@@ -83,82 +148,118 @@ async def send_order(data: Dict[str, Any], broker: Broker | None = None) -> Dict
 # Отправка парного ордера (арбитраж)
 # ---------------------------------------------------------------------------
 
-async def send_pair_order(data: Dict[str, Any], broker: Broker | None = None) -> Tuple[bool, str]:  # noqa: D401
+# OPERATION QUIK по стороне из GUI: частые значения – словарём, прочие – по первой букве
+_OPERATIONS: Dict[str, str] = {"B": "B", "BUY": "B", "S": "S", "SELL": "S"}
+
+# Рыночная заявка ноги: PRICE = "0", TYPE = "M"
+_MARKET_ORDER_TEMPLATE: Dict[str, Any] = {**_ORDER_TEMPLATE, "TYPE": "M"}
+
+
+# Обязательные поля send_pair_order (порядок важен – распаковываются по порядку)
+_PAIR_REQUIRED_FIELDS = ("class_code_1", "sec_code_1", "class_code_2", "sec_code_2", "side_1", "side_2")
+
+
+def _operation(side: Any) -> str:
+    """'B' для покупки (значения, начинающиеся с B), иначе 'S'."""
+    side = str(side).upper()
+    op = _OPERATIONS.get(side)
+    if op is None:
+        op = "B" if side.startswith("B") else "S"
+    return op
+
+
+def _market_order(class_code, sec_code, account, client_code, operation, qty: int, trans_id: int) -> Dict[str, Any]:
+    """Транзакция рыночной заявки ноги – копия шаблона с заполненными полями."""
+    order = _MARKET_ORDER_TEMPLATE.copy()
+    order["CLASSCODE"] = class_code
+    order["SECCODE"] = sec_code
+    order["ACCOUNT"] = account
+    order["CLIENT_CODE"] = client_code
+    order["OPERATION"] = operation
+    order["QUANTITY"] = str(qty)
+    order["TRANS_ID"] = str(trans_id)
+    return order
+
+
+# Справочники, которые send_pair_order читал из БД на каждой отправке:
+# (ticker, board) → Instrument.id и id активного портфеля. Заполняются только
+# после успешного commit, из приложения эти строки не удаляются.
+_instrument_ids: Dict[Tuple[str, str], int] = {}
+_default_portfolio_id: Optional[int] = None
+
+
+def _upsert_insert(sess):
+    """`insert` с поддержкой ON CONFLICT для диалекта сессии (SQLite / PostgreSQL)."""
+    if sess.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+@_with_default_broker
+async def send_pair_order(data: Dict[str, Any], *, broker: Broker) -> Tuple[bool, str]:  # noqa: D401
     """Отправляет два синхронных рыночных ордера (парный арбитраж) и сохраняет их в БД."""
+    global _default_portfolio_id
     try:
         from db.models import Order, OrderStatus, Side, Instrument, PortfolioConfig
         from sqlalchemy import select
-        import logging
-        
-        logger = logging.getLogger(__name__)
         
-        # Безопасно получаем обязательные поля
-        class_code_1 = data.get("class_code_1")
-        sec_code_1 = data.get("sec_code_1")
-        class_code_2 = data.get("class_code_2")
-        sec_code_2 = data.get("sec_code_2")
-        side_1 = data.get("side_1")
-        side_2 = data.get("side_2")
+        # Безопасно получаем обязательные поля – одним проходом по списку
+        required = {field: data.get(field) for field in _PAIR_REQUIRED_FIELDS}
+        class_code_1, sec_code_1, class_code_2, sec_code_2, side_1, side_2 = required.values()
         pair_id = data.get("pair_id")  # Database ID of the trading pair
         
         logger.info(f"[SEND_PAIR_ORDER] Получен запрос: pair_id={pair_id}, {sec_code_1}/{sec_code_2}")
         
         # Проверяем обязательные поля
-        if not all([class_code_1, sec_code_1, class_code_2, sec_code_2, side_1, side_2]):
-            missing_fields = []
-            if not class_code_1: missing_fields.append("class_code_1")
-            if not sec_code_1: missing_fields.append("sec_code_1") 
-            if not class_code_2: missing_fields.append("class_code_2")
-            if not sec_code_2: missing_fields.append("sec_code_2")
-            if not side_1: missing_fields.append("side_1")
-            if not side_2: missing_fields.append("side_2")
+        missing_fields = [field for field, value in required.items() if not value]
+        if missing_fields:
             return False, f"Missing required fields: {', '.join(missing_fields)}"
         
         qty1 = int(data.get("qty_ratio_1", 0))
         qty2 = int(data.get("qty_ratio_2", 0))
         account1, client1 = data.get("account_1"), data.get("client_code_1")
         account2, client2 = data.get("account_2"), data.get("client_code_2")
-        op1 = "B" if str(side_1).upper().startswith("B") else "S"
-        op2 = "B" if str(side_2).upper().startswith("B") else "S"
+        op1 = _operation(side_1)
+        op2 = _operation(side_2)
         
-        async with AsyncSessionLocal() as sess:
-            trans1 = await get_next_trans_id(sess)
-            trans2 = trans1 + 1
-            
-            # Получаем или создаём инструменты
-            stmt1 = select(Instrument).where(
-                Instrument.ticker == sec_code_1,
-                Instrument.board == class_code_1
-            )
-            result1 = await sess.execute(stmt1)
-            instrument1 = result1.scalar_one_or_none()
-            if not instrument1:
-                instrument1 = Instrument(
-                    ticker=sec_code_1, board=class_code_1, 
-                    lot_size=1, price_precision=2
-                )
-                sess.add(instrument1)
-                await sess.flush()
+        # Одна транзакция на всю запись: commit при выходе из блока, rollback при ошибке
+        async with AsyncSessionLocal.begin() as sess:
+            trans1, trans2 = await get_next_trans_ids(sess, 2)
             
-            stmt2 = select(Instrument).where(
-                Instrument.ticker == sec_code_2,
-                Instrument.board == class_code_2
-            )
-            result2 = await sess.execute(stmt2)
-            instrument2 = result2.scalar_one_or_none()
-            if not instrument2:
-                instrument2 = Instrument(
-                    ticker=sec_code_2, board=class_code_2,
-                    lot_size=1, price_precision=2
-                )
-                sess.add(instrument2)
-                await sess.flush()
+            # Id инструментов и портфеля – из кэша; в БД идём только за недостающими
+            leg_keys = [(sec_code_1, class_code_1), (sec_code_2, class_code_2)]
+            instrument_ids = {k: _instrument_ids[k] for k in leg_keys if k in _instrument_ids}
+            missing = [k for k in leg_keys if k not in instrument_ids]
+            if missing:
+                # Upsert по уникальному ticker: одна атомарная команда вместо
+                # SELECT + INSERT + flush, без гонки между параллельными отправками
+                insert = _upsert_insert(sess)
+                rows = {t: {"ticker": t, "board": b, "lot_size": 1, "price_precision": 2} for t, b in missing}
+                stmt_instr = insert(Instrument).values(list(rows.values()))
+                stmt_instr = stmt_instr.on_conflict_do_update(
+                    index_elements=[Instrument.ticker],
+                    set_={"ticker": stmt_instr.excluded.ticker},
+                ).returning(Instrument.ticker, Instrument.board, Instrument.id)
+                found = {t: (b, iid) for t, b, iid in (await sess.execute(stmt_instr)).all()}
+                for ticker, board in missing:
+                    db_board, iid = found[ticker]
+                    # Конфликт только по ticker: инструмент мог быть заведён с другим board –
+                    # не кэшируем его под чужим ключом и не пишем ордер на чужой инструмент
+                    if db_board != board:
+                        logger.warning(
+                            "[SEND_PAIR_ORDER] %s: в БД board=%s, запрошен %s", ticker, db_board, board
+                        )
+                        raise ValueError(f"Instrument {ticker} exists with board {db_board}, not {board}")
+                    instrument_ids[(ticker, board)] = iid
+            portfolio_id = _default_portfolio_id
+            if portfolio_id is None:
+                stmt_port = select(PortfolioConfig.id).where(PortfolioConfig.active == True).limit(1)
+                portfolio_id = (await sess.execute(stmt_port)).scalar_one_or_none()
             
-            # Получаем или создаём дефолтный портфель
-            stmt_port = select(PortfolioConfig).where(PortfolioConfig.active == True).limit(1)
-            result_port = await sess.execute(stmt_port)
-            portfolio = result_port.scalar_one_or_none()
-            if not portfolio:
+            # Создаём дефолтный портфель, если активного нет
+            if portfolio_id is None:
                 portfolio = PortfolioConfig(
                     name="Default Portfolio",
                     config_json={},
@@ -166,13 +267,15 @@ async def send_pair_order(data: Dict[str, Any], broker: Broker | None = None) ->
                 )
                 sess.add(portfolio)
                 await sess.flush()
+                portfolio_id = portfolio.id
+            instrument1_id, instrument2_id = (instrument_ids[k] for k in leg_keys)
             
             # Создаём записи Order в БД
             order_rec_1 = Order(
                 trans_id=trans1,
-                portfolio_id=portfolio.id,
+                portfolio_id=portfolio_id,
                 pair_id=pair_id,  # Связываем с парой
-                instrument_id=instrument1.id,
+                instrument_id=instrument1_id,
                 side=Side.LONG if op1 == "B" else Side.SHORT,
                 price=0.0,  # Рыночная заявка
                 qty=qty1,
@@ -180,38 +283,29 @@ async def send_pair_order(data: Dict[str, Any], broker: Broker | None = None) ->
             )
             order_rec_2 = Order(
                 trans_id=trans2,
-                portfolio_id=portfolio.id,
+                portfolio_id=portfolio_id,
                 pair_id=pair_id,  # Связываем с парой
-                instrument_id=instrument2.id,
+                instrument_id=instrument2_id,
                 side=Side.LONG if op2 == "B" else Side.SHORT,
                 price=0.0,  # Рыночная заявка
                 qty=qty2,
                 status=OrderStatus.NEW
             )
-            sess.add(order_rec_1)
-            sess.add(order_rec_2)
-            await sess.commit()
-            
-            logger.info(f"[SEND_PAIR_ORDER] Созданы Order ID={order_rec_1.id} и ID={order_rec_2.id} с pair_id={pair_id}")
-            
-            # Регистрируем маппинг в OrderManager
-            om = container.order_manager()
-            om._register_trans_mapping(trans1, order_rec_1.id)
-            om._register_trans_mapping(trans2, order_rec_2.id)
-
-        order1 = {
-            "ACTION": "NEW_ORDER","CLASSCODE": class_code_1,"SECCODE": sec_code_1,
-            "ACCOUNT": account1,"CLIENT_CODE": client1,"OPERATION": op1,
-            "QUANTITY": str(qty1),"PRICE": "0","TYPE": "M","TRANS_ID": str(trans1),
-        }
-        order2 = {
-            "ACTION": "NEW_ORDER","CLASSCODE": class_code_2,"SECCODE": sec_code_2,
-            "ACCOUNT": account2,"CLIENT_CODE": client2,"OPERATION": op2,
-            "QUANTITY": str(qty2),"PRICE": "0","TYPE": "M","TRANS_ID": str(trans2),
-        }
-        broker = broker or _get_broker()
-        res1 = await broker.place_market_order(order1)
-        res2 = await broker.place_market_order(order2)
+            sess.add_all([order_rec_1, order_rec_2])
+        _instrument_ids.update(instrument_ids)
+        _default_portfolio_id = portfolio_id
+        
+        logger.info(f"[SEND_PAIR_ORDER] Созданы Order ID={order_rec_1.id} и ID={order_rec_2.id} с pair_id={pair_id}")
+        
+        # Регистрируем маппинг в OrderManager
+        om = _get_order_manager()
+        om._register_trans_mapping(trans1, order_rec_1.id)
+        om._register_trans_mapping(trans2, order_rec_2.id)
+
+        order1 = _market_order(class_code_1, sec_code_1, account1, client1, op1, qty1, trans1)
+        order2 = _market_order(class_code_2, sec_code_2, account2, client2, op2, qty2, trans2)
+        # Обе ноги – одной пакетной отправкой: брокер шлёт их подряд, без возврата в event-loop
+        res1, res2 = await broker.place_market_orders([order1, order2])
         ok = (str(res1.get("result", "0")) != "-1") and (str(res2.get("result", "0")) != "-1")
         msg_text = "" if ok else f"Order errors: {res1}, {res2}"
         return ok, msg_text
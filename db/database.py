@@ -18,8 +18,10 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
+import sqlite3
 from typing import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -37,9 +39,41 @@ logger = logging.getLogger(__name__)
 DEFAULT_SQLITE_URL = "sqlite+aiosqlite:///./arbitrage.db"
 DATABASE_URL = os.environ.get("DATABASE_URL", DEFAULT_SQLITE_URL)
 
-async_engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=False, future=True)
+# Файловый SQLite (aiosqlite) уже работает через AsyncAdaptedQueuePool с настройками
+# по умолчанию (5 + 10), in-memory – на одном соединении: их пул не трогаем.
+# Сетевым СУБД добавляем pre-ping и пересоздание соединений – их рвёт сервер/сеть.
+_NETWORK_POOL_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+_engine_options = {} if DATABASE_URL.startswith("sqlite") else _NETWORK_POOL_OPTIONS
+
+async_engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=False, future=True, **_engine_options)
 AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
 
+# PRAGMA для каждого нового SQLite-соединения: WAL не блокирует читателей на время
+# записи, synchronous=NORMAL в WAL – fsync только на checkpoint, а не на каждый commit
+# (выдача TRANS_ID, статусы ордеров); busy_timeout – ждать блокировку, а не падать
+# с «database is locked».
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+if async_engine.dialect.name == "sqlite":
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in _SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
 
 class Base(DeclarativeBase):
     """Базовый класс для ORM-моделей."""
@@ -64,10 +98,35 @@ async def init_db() -> None:
     async with async_engine.begin() as conn:
         # важное: checkfirst=True, иначе попытка создать уже существующую таблицу упадёт
         await conn.run_sync(Base.metadata.create_all, checkfirst=True)
+        if conn.dialect.name == "sqlite":
+            await _refresh_sqlite_stats(conn)
 
     logger.info("[db] Таблицы готовы.")
 
 
+async def _refresh_sqlite_stats(conn) -> None:
+    """Статистика планировщика SQLite для составных индексов.
+
+    Без sqlite_stat1 планировщик выбирает индекс наугад (например, для
+    portfolio_id + status или instrument_id + ts). Пока статистики по orders нет
+    (новая БД, ANALYZE по пустым таблицам) и на SQLite < 3.46 – полный ANALYZE:
+    там PRAGMA optimize на новом соединении ничего не анализирует. На 3.46+ при
+    готовой статистике – PRAGMA optimize=0x10002: он проверяет все таблицы, а не
+    только прочитанные этим соединением, и переанализирует лишь изменившиеся.
+    """
+    has_orders_stats = False
+    if (
+        await conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    ).first() is not None:
+        has_orders_stats = (
+            await conn.exec_driver_sql("SELECT 1 FROM sqlite_stat1 WHERE tbl = 'orders' LIMIT 1")
+        ).first() is not None
+    if has_orders_stats and sqlite3.sqlite_version_info >= (3, 46, 0):
+        await conn.exec_driver_sql("PRAGMA optimize=0x10002")
+    else:
+        await conn.exec_driver_sql("ANALYZE")
+
+
 async def close_db() -> None:
     """Закрыть connection-pool при завершении приложения."""
 
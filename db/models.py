@@ -2,7 +2,8 @@
 ORM-схема проекта (пакет `db`).
 
 •   PK/FK/индексы → исключаем дубляж и ускоряют джоины
-•   __repr__      → удобнее читать логи / отладку
+•   __repr__      → удобнее читать логи / отладку; только собственные колонки
+                    (FK – id), чтобы форматирование не запускало lazy-load связей
 """
 
 from __future__ import annotations
@@ -24,13 +25,44 @@ from sqlalchemy import (
     UniqueConstraint,
     Index,
     inspect,
+    text,
 )
 from sqlalchemy.dialects.sqlite import JSON  # заменится на JSONB/JSON для PostgreSQL
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.types import Text
 
 from .database import Base
 
+
+class utcnow(FunctionElement):
+    """Текущее время UTC на стороне БД (naive, как datetime.utcnow).
+
+    Используется как default/onupdate колонок-меток времени в потоковых таблицах:
+    значение подставляется прямо в текст INSERT/UPDATE, без вызова Python на каждую
+    строку и без изменения схемы (это не server_default).
+    """
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP в SQLite – с точностью до секунды; %f даёт миллисекунды
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
 # -- справочники -------------------------------------------------------------
 
 
@@ -189,7 +221,7 @@ class Quote(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     instrument_id: Mapped[int] = mapped_column(ForeignKey("instruments.id"), nullable=False)
-    ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    ts: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
 
     bid: Mapped[float] = mapped_column(Numeric(18, 6))
     bid_qty: Mapped[int] = mapped_column(Integer)
@@ -199,7 +231,7 @@ class Quote(Base):
     instrument = relationship("Instrument", back_populates="quotes")
 
     def __repr__(self) -> str:  # noqa: D401
-        return f"<Quote {self.instrument.ticker} {self.ts:%H:%M:%S} bid={self.bid} ask={self.ask}>"
+        return f"<Quote inst={self.instrument_id} {self.ts:%H:%M:%S} bid={self.bid} ask={self.ask}>"
 
 
 # -- портфели / стратегии ----------------------------------------------------
@@ -262,7 +294,7 @@ class PortfolioPosition(Base):
     instrument = relationship("Instrument")
 
     def __repr__(self) -> str:  # noqa: D401
-        return f"<Pos {self.portfolio.name}:{self.instrument.ticker} {self.side} {self.qty}>"
+        return f"<Pos pf={self.portfolio_id}:inst={self.instrument_id} {self.side} {self.qty}>"
 
 
 # -- ордера / сделки ---------------------------------------------------------
@@ -282,6 +314,17 @@ class Order(Base):
     __table_args__ = (
         Index("ix_orders_portfolio_status", "portfolio_id", "status"),
         Index("ix_orders_trans_id", "trans_id"),
+        # Выдача TRANS_ID: max(trans_id) WHERE created_at >= начало дня – только по индексу
+        Index("ix_orders_created_trans", "created_at", "trans_id"),
+        # Пересчёт exec_price пары: pair_id = ? AND filled > 0 AND exec_price IS NOT NULL
+        Index("ix_orders_pair_active", "pair_id", "filled", "exec_price"),
+        # Частичный индекс для cleanup.py: ордера без привязки к паре
+        Index(
+            "ix_orders_pair_id_null",
+            "pair_id",
+            sqlite_where=text("pair_id IS NULL"),
+            postgresql_where=text("pair_id IS NULL"),
+        ),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -301,15 +344,15 @@ class Order(Base):
 
     status: Mapped[OrderStatus] = mapped_column(Enum(OrderStatus), default=OrderStatus.NEW)
 
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), onupdate=utcnow())
     executed_at: Mapped[datetime | None] = mapped_column(DateTime)
 
     portfolio = relationship("PortfolioConfig", back_populates="orders")
     instrument = relationship("Instrument")
 
     def __repr__(self) -> str:  # noqa: D401
-        return f"<Order {self.id}/{self.quik_num} {self.instrument.ticker} {self.side} {self.qty}@{self.price} {self.status}>"
+        return f"<Order {self.id}/{self.quik_num} inst={self.instrument_id} {self.side} {self.qty}@{self.price} {self.status}>"
 
 
 class Trade(Base):
@@ -320,7 +363,7 @@ class Trade(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     instrument_id: Mapped[int] = mapped_column(ForeignKey("instruments.id"), nullable=False)
-    ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    ts: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
 
     price: Mapped[float] = mapped_column(Numeric(18, 6), nullable=False)
     qty: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -329,7 +372,7 @@ class Trade(Base):
     instrument = relationship("Instrument")
 
     def __repr__(self) -> str:  # noqa: D401
-        return f"<Trade {self.instrument.ticker} {self.ts:%H:%M:%S} {self.side} {self.qty}@{self.price}>"
+        return f"<Trade inst={self.instrument_id} {self.ts:%H:%M:%S} {self.side} {self.qty}@{self.price}>"
 
 
 if __name__ == "__main__":
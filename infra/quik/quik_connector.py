@@ -115,7 +115,12 @@ class QuikConnector:
         self._initialized = True
 
         # Инициализируем все атрибуты ДО попытки подключения
-        self._quote_callbacks: Dict[str, list[QuoteCallback]] = {}
+        # Ключ – кортеж (class_code, sec_code): на каждой котировке не собираем строку
+        self._quote_callbacks: Dict[tuple[str, str], list[QuoteCallback]] = {}
+        # (Un)subscribe вызываются из worker-потоков (asyncio.to_thread в ws): счётчик
+        # подписчиков и RPC подписки/отписки L2 – под одним lock, чтобы два клиента
+        # не пропустили первую подписку и не сняли L2 у ещё подписанного клиента
+        self._quote_subs_lock = threading.Lock()
         self._trade_callbacks: Dict[str, list[TradeCallback]] = {}
         self._order_callbacks: Dict[str, list[OrderCallback]] = {}
         self._event_queue: "asyncio.Queue[dict[str, Any]]" = asyncio.Queue(maxsize=1000)
@@ -124,6 +129,8 @@ class QuikConnector:
         self._heartbeat_callbacks: list[Callable[[dict[str, Any]], None]] = []
         self._last_heartbeat_time: float = 0.0
         self._use_dummy_quotes: bool = False
+        # Обработчики OrderManager по типу события (заполняются при первом событии)
+        self._om_handlers: Optional[Dict[str, Callable[[dict[str, Any]], None]]] = None
 
         host_real = host or "127.0.0.1"
         # Пытаемся подключиться к реальному QuikPy; если соединение отказано –
@@ -234,23 +241,26 @@ class QuikConnector:
     # ------------------------------------------------------------------
 
     def subscribe_quotes(self, class_code: str, sec_code: str, cb: QuoteCallback) -> None:
-        key = f"{class_code}.{sec_code}"
-        self._quote_callbacks.setdefault(key, []).append(cb)
-        if len(self._quote_callbacks[key]) == 1:
-            self._qp.subscribe_level2_quotes(class_code, sec_code)
-            logger.info("Subscribed L2 %s", key)
+        key = (class_code, sec_code)
+        with self._quote_subs_lock:
+            callbacks = self._quote_callbacks.setdefault(key, [])
+            callbacks.append(cb)
+            if len(callbacks) == 1:
+                self._qp.subscribe_level2_quotes(class_code, sec_code)
+                logger.info("Subscribed L2 %s.%s", class_code, sec_code)
 
     def unsubscribe_quotes(self, class_code: str, sec_code: str, cb: QuoteCallback) -> None:
-        key = f"{class_code}.{sec_code}"
-        callbacks = self._quote_callbacks.get(key)
-        if not callbacks:
-            return
-        if cb in callbacks:
-            callbacks.remove(cb)
-        if not callbacks:
-            self._qp.unsubscribe_level2_quotes(class_code, sec_code)
-            del self._quote_callbacks[key]
-            logger.info("Unsubscribed L2 %s", key)
+        key = (class_code, sec_code)
+        with self._quote_subs_lock:
+            callbacks = self._quote_callbacks.get(key)
+            if not callbacks:
+                return
+            if cb in callbacks:
+                callbacks.remove(cb)
+            if not callbacks:
+                self._qp.unsubscribe_level2_quotes(class_code, sec_code)
+                del self._quote_callbacks[key]
+                logger.info("Unsubscribed L2 %s.%s", class_code, sec_code)
 
     # ------------------------------------------------------------------
     # Подписки на сделки (trades)
@@ -294,39 +304,35 @@ class QuikConnector:
     # Торговые операции (вызовы через ThreadPoolExecutor)
     # ------------------------------------------------------------------
 
-    async def _send_transaction(self, tr: dict[str, Any]) -> dict[str, Any]:
-        """Универсальный вызов SendTransaction/Send_Transaction c fallback аргументов.
-
-        Проблема: в разных версиях QuikPy доступна либо `send_transaction(self, transaction)`,
-        либо `SendTransaction(self, transaction)`, а иногда – свободная функция, которая
-        ожидает **именованный** аргумент `transaction`. Этот хелпер пытается вызвать все варианты
-        (positional + keyword) до первого успешного ответа.
-        """
-        loop = asyncio.get_running_loop()
+    # Имена метода отправки транзакции в разных версиях QuikPy
+    _SEND_TRANSACTION_NAMES = ("send_transaction", "sendTransaction", "SendTransaction")
 
-        def _try(func, *f_args, **f_kwargs):  # noqa: ANN001
-            try:
-                return loop.run_in_executor(None, func, *f_args, **f_kwargs)
-            except TypeError:
-                return None
+    def _send_transaction_sync(self, tr: dict[str, Any]) -> dict[str, Any]:
+        """Синхронная отправка транзакции (выполняется в потоке executor'а).
 
-        # Перебираем возможные имена метода
-        for name in ("send_transaction", "sendTransaction", "SendTransaction"):
+        В разных версиях QuikPy доступен `send_transaction`, `sendTransaction` или
+        `SendTransaction` – вызываем первый найденный.
+        """
+        for name in self._SEND_TRANSACTION_NAMES:
             func = getattr(self._qp, name, None)
-            if func is None:
-                continue
-            # 1. Пытаемся передать позиционный аргумент
-            fut = _try(func, tr)
-            if fut:
-                return await fut
-            # 2. Пробуем именованный параметр
-            fut = _try(func, transaction=tr)
-            if fut:
-                return await fut
-
-        # Если ни один вариант не подошёл, генерируем исключение
+            if func is not None:
+                return func(tr)
         raise AttributeError("Не найден совместимый метод send_transaction в QuikPy")
 
+    async def _send_transaction(self, tr: dict[str, Any]) -> dict[str, Any]:
+        """Отправляет транзакцию через QuikPy в потоке executor'а."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._send_transaction_sync, tr)
+
+    def _order_failed(self, tr: dict[str, Any], exc: BaseException, what: str) -> dict[str, Any]:
+        """Ошибка отправки заявки: лог с traceback, событие error в очередь, ответ result=-1."""
+        logger.error("Ошибка при отправке %s: %s", what, exc, exc_info=exc)
+        error_event = {"type": "error", "message": str(exc), "details": {"order": tr}}
+        try:
+            self._event_queue.put_nowait(error_event)
+        except asyncio.QueueFull:
+            logger.debug("Event queue full — dropping error event")
+        return {"result": -1, "message": str(exc)}
+
     async def place_limit_order(self, tr: dict[str, Any]) -> dict[str, Any]:
         print(f"===> Отправка заявки: {tr}")
         try:
@@ -336,13 +342,7 @@ class QuikConnector:
             return result
         except Exception as exc:
             print(f"===> Ошибка при отправке заявки: {exc}")
-            logger.exception(f"Ошибка при отправке лимитного ордера: {exc}")
-            error_event = {"type": "error", "message": str(exc), "details": {"order": tr}}
-            try:
-                self._event_queue.put_nowait(error_event)
-            except asyncio.QueueFull:
-                logger.debug("Event queue full — dropping error event")
-            return {"result": -1, "message": str(exc)}
+            return self._order_failed(tr, exc, "лимитного ордера")
 
     async def place_market_order(self, tr: dict[str, Any]) -> dict[str, Any]:
         print(f"===> Отправка заявки: {tr}")
@@ -353,13 +353,33 @@ class QuikConnector:
             logger.info(f"Ответ QUIK на маркет-ордер: {result}")
             return result
         except Exception as exc:
-            logger.exception("Ошибка при отправке рыночного ордера: %s", exc)
-            error_event = {"type": "error", "message": str(exc), "details": {"order": tr}}
-            try:
-                self._event_queue.put_nowait(error_event)
-            except asyncio.QueueFull:
-                logger.debug("Event queue full — dropping error event")
-            return {"result": -1, "message": str(exc)}
+            return self._order_failed(tr, exc, "рыночного ордера")
+
+    async def place_market_orders(self, trs: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Отправляет несколько рыночных заявок подряд одним заданием в executor.
+
+        QuikPy сериализует запросы своим lock'ом, поэтому отдельные вызовы
+        `place_market_order` всё равно выстраиваются в очередь между потоками пула.
+        Здесь все транзакции уходят из одного потока друг за другом, без возврата
+        в event-loop между ними. Ответы возвращаются в порядке `trs`.
+        """
+        def _send_all() -> list[Any]:
+            results: list[Any] = []
+            for tr in trs:
+                try:
+                    results.append(self._send_transaction_sync(tr))
+                except Exception as exc:  # ошибка одной заявки не останавливает остальные
+                    results.append(exc)
+            return results
+
+        results = await asyncio.get_running_loop().run_in_executor(None, _send_all)
+        for i, (tr, result) in enumerate(zip(trs, results)):
+            if isinstance(result, Exception):
+                # Событие и лог – в потоке event-loop (asyncio.Queue не потокобезопасна)
+                results[i] = self._order_failed(tr, result, "рыночного ордера")
+            else:
+                logger.info("Ответ QUIK на маркет-ордер: %s", result)
+        return results
 
     async def cancel_order(
         self,
@@ -452,8 +472,7 @@ class QuikConnector:
         import random, time
 
         while not self._stop_quote_thread.is_set():
-            for key, callbacks in list(self._quote_callbacks.items()):
-                class_code, sec_code = key.split(".")
+            for (class_code, sec_code), callbacks in list(self._quote_callbacks.items()):
                 quote = {
                     "class_code": class_code,
                     "sec_code": sec_code,
@@ -479,38 +498,37 @@ class QuikConnector:
     # ------------------------------------------------------------------
     # Вызов колбэков для trades и orders (шаблон для интеграции)
     # ------------------------------------------------------------------
-    def _on_trade(self, event):
-        from core.order_manager import OrderManager
-        from config import container as _c  # lazy import to avoid circular
+    def _dispatch_order_event(self, kind: str, event: dict[str, Any]) -> None:
+        """Передаёт событие QUIK обработчику OrderManager по его типу.
+
+        OrderManager берётся из DI-контейнера один раз; дальше каждое событие –
+        это один поиск в словаре и вызов связанного метода.
+        """
         payload = event.get("data", event)
-        payload["type"] = "trade"
+        payload["type"] = kind
         payload["cmd"] = event.get("cmd")
         try:
-            _c.order_manager().on_trade_event(payload)
+            handlers = self._om_handlers
+            if handlers is None:
+                from config import container as _c  # lazy import to avoid circular
+                om = _c.order_manager()
+                handlers = self._om_handlers = {
+                    "trade": om.on_trade_event,
+                    "order": om.on_order_event,
+                    "trans_reply": om.on_trans_reply_event,
+                }
+            handlers[kind](payload)
         except Exception as e:
-            logger.exception(f"[_on_trade] Ошибка при обработке OnTrade: {e}")
+            logger.exception("[_on_%s] Ошибка при обработке %s: %s", kind, payload["cmd"], e)
+
+    def _on_trade(self, event):
+        self._dispatch_order_event("trade", event)
 
     def _on_order(self, event):
-        from core.order_manager import OrderManager
-        from config import container as _c
-        payload = event.get("data", event)
-        payload["type"] = "order"
-        payload["cmd"] = event.get("cmd")
-        try:
-            _c.order_manager().on_order_event(payload)
-        except Exception as e:
-            logger.exception(f"[_on_order] Ошибка при обработке OnOrder: {e}")
+        self._dispatch_order_event("order", event)
 
     def _on_trans_reply(self, event):
-        from core.order_manager import OrderManager
-        from config import container as _c
-        payload = event.get("data", event)
-        payload["type"] = "trans_reply"
-        payload["cmd"] = event.get("cmd")
-        try:
-            _c.order_manager().on_trans_reply_event(payload)
-        except Exception as e:
-            logger.exception(f"[_on_trans_reply] Ошибка при обработке OnTransReply: {e}")
+        self._dispatch_order_event("trans_reply", event)
 
     def _on_heartbeat(self, event):
         """Обработчик heartbeat от QUIK."""
@@ -561,7 +579,7 @@ class QuikConnector:
 
         class_code = payload.get("class_code") or payload.get("classCode")
         sec_code = payload.get("sec_code") or payload.get("secCode")
-        key = f"{class_code}.{sec_code}" if class_code and sec_code else ""
+        key = (class_code, sec_code)
 
         # Отправляем в очередь событий (если не переполнена)
         try:
@@ -617,10 +635,10 @@ class QuikConnector:
         # Пересоздаём QuikPy
         self._qp = QuikPy()
         # Повторно подписываемся на все активные инструменты
-        for key in self._quote_callbacks:
-            class_code, sec_code = key.split(".")
-            self._qp.subscribe_level2_quotes(class_code, sec_code)
-            logger.info("Reconnect: подписка L2 %s", key)
+        with self._quote_subs_lock:
+            for class_code, sec_code in self._quote_callbacks:
+                self._qp.subscribe_level2_quotes(class_code, sec_code)
+                logger.info("Reconnect: подписка L2 %s.%s", class_code, sec_code)
         for key in self._trade_callbacks:
             class_code, sec_code = key.split(".")
             self._qp.subscribe_trades(class_code, sec_code)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from core.broker import Broker, QuoteCallback
 from infra.quik import QuikConnector
@@ -34,6 +34,9 @@ class QuikBrokerAdapter(Broker):
     async def place_market_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:  # noqa: D401
         return await self._connector.place_market_order(order_data)
 
+    async def place_market_orders(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:  # noqa: D401
+        return await self._connector.place_market_orders(orders)
+
     async def place_limit_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:  # noqa: D401
         return await self._connector.place_limit_order(order_data)
 
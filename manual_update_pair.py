@@ -9,17 +9,15 @@ exec_price = SUM(price_1 * qty_1 / qty_ratio_1) * price_ratio_1
 """
 import asyncio
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
 from db.database import AsyncSessionLocal
-from db.models import Order, Pair, Asset
+from db.models import Order, Pair, Asset, Instrument
 
 async def update_all_pairs():
     async with AsyncSessionLocal() as session:
         # Загружаем справочник алиасов: sec_code -> code
-        stmt_assets = select(Asset).where(Asset.sec_code.isnot(None), Asset.code.isnot(None))
+        stmt_assets = select(Asset.sec_code, Asset.code).where(Asset.sec_code.isnot(None), Asset.code.isnot(None))
         result_assets = await session.execute(stmt_assets)
-        assets = result_assets.scalars().all()
-        ticker_to_alias = {a.sec_code: a.code for a in assets}
+        ticker_to_alias = {sec_code: code for sec_code, code in result_assets}
         
         print(f"📚 Справочник алиасов: {ticker_to_alias}\n")
         
@@ -31,14 +29,18 @@ async def update_all_pairs():
         print(f"Найдено пар: {len(pairs)}\n")
         
         for pair in pairs:
-            # Получаем ордера этой пары с инструментами
-            stmt_orders = select(Order).options(selectinload(Order.instrument)).where(
-                Order.pair_id == pair.id,
-                Order.filled > 0,
-                Order.exec_price.isnot(None)
+            # Получаем ордера этой пары с тикерами: только нужные колонки, без ORM-объектов
+            stmt_orders = (
+                select(Order.id, Order.filled, Order.exec_price, Instrument.ticker)
+                .outerjoin(Instrument, Instrument.id == Order.instrument_id)
+                .where(
+                    Order.pair_id == pair.id,
+                    Order.filled > 0,
+                    Order.exec_price.isnot(None)
+                )
             )
             result_orders = await session.execute(stmt_orders)
-            orders = result_orders.scalars().all()
+            orders = result_orders.all()
             
             if not orders:
                 print(f"Пара ID={pair.id} ({pair.asset_1}/{pair.asset_2}): нет исполненных ордеров")
@@ -60,7 +62,7 @@ async def update_all_pairs():
             
             for ord in orders:
                 if ord.exec_price and ord.filled:
-                    ticker = ord.instrument.ticker if ord.instrument else "?"
+                    ticker = ord.ticker or "?"
                     alias = ticker_to_alias.get(ticker, ticker)  # Fallback на ticker
                     exec_price_float = float(ord.exec_price)
                     
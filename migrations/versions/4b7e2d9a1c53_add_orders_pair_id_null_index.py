@@ -0,0 +1,35 @@
+"""add_orders_pair_id_null_index
+
+Revision ID: 4b7e2d9a1c53
+Revises: ce8b0e30fed1
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e2d9a1c53'
+down_revision: Union[str, None] = 'ce8b0e30fed1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_orders_pair_id_null',
+        'orders',
+        ['pair_id'],
+        unique=False,
+        sqlite_where=sa.text('pair_id IS NULL'),
+        postgresql_where=sa.text('pair_id IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_pair_id_null', table_name='orders')
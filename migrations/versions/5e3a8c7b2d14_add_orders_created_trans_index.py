@@ -0,0 +1,28 @@
+"""add_orders_created_trans_index
+
+Revision ID: 5e3a8c7b2d14
+Revises: 9d2f6c1e8a47
+Create Date: 2026-10-16 14:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e3a8c7b2d14'
+down_revision: Union[str, None] = '9d2f6c1e8a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_orders_created_trans', 'orders', ['created_at', 'trans_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_created_trans', table_name='orders')
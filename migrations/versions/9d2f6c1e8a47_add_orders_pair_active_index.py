@@ -0,0 +1,28 @@
+"""add_orders_pair_active_index
+
+Revision ID: 9d2f6c1e8a47
+Revises: 4b7e2d9a1c53
+Create Date: 2026-10-16 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2f6c1e8a47'
+down_revision: Union[str, None] = '4b7e2d9a1c53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_orders_pair_active', 'orders', ['pair_id', 'filled', 'exec_price'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_pair_active', table_name='orders')